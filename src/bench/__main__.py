@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run the benchmark suite: ``python -m bench [-o results.json]``.
+"""
+
+from .bench import compare, run
+
+from argparse import ArgumentParser
+
+import json
+import logging
+import sys
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the query engine.')
+    parser.add_argument(
+        '--scale',
+        type=float,
+        default=.1,
+        help='Size of the synthetic raster relative to 21600 x 43200',
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='Timed loops per benchmark',
+    )
+    parser.add_argument(
+        '--instance',
+        type=str,
+        help='Instance directory to reuse, generated if it has no data',
+    )
+    parser.add_argument(
+        '--no-handlers',
+        action='store_true',
+        help='Skip the HTTP handler benchmarks',
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        help='Write the results to this JSON file instead of stdout',
+    )
+    parser.add_argument(
+        '--compare',
+        type=str,
+        help='Baseline JSON file; exit with 1 if a benchmark regressed',
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=1.1,
+        help='Slowdown ratio counted as a regression',
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    results = run(args.scale, args.repeat, not args.no_handlers,
+                  args.instance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = False
+        for entry in compare(baseline, results, args.threshold):
+            flag = 'REGRESSED' if entry['regressed'] else \
+                'improved' if entry['improved'] else ''
+            logging.info(f'{entry["name"]} {entry["params"]}: '
+                         f'x{entry["ratio"]:.2f} {flag}')
+            regressed |= entry['regressed']
+        sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
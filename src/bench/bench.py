@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite of the query engine, on a synthetic raster so that it needs
+no GPW download.
+
+Every benchmark yields one record: its name, parameters and timings in
+seconds, written as JSON so that runs can be compared with `compare`.
+"""
+
+from config import CONFIG
+from data_manip import DataManipulator
+
+from typing import Any, Callable, Dict, Iterable, List
+
+import asyncio
+import json
+import logging
+import math
+import numpy as np
+import os
+import platform
+import statistics
+import time
+
+RADII = (.01, .05, .2)  # polygon radius, relative to the raster height
+VERTICES = (4, 16, 64, 256)
+GRID_CELLS = 50  # cells along the longer side of a grid query
+
+
+def make_instance(directory: str, scale: float = .1, seed: int = 0):
+    """
+    Preprocess a random raster of ``scale`` times the GPW size into
+    ``directory``, which becomes `CONFIG.INSTANCE_DIR`.
+
+    :param directory: Instance directory.
+    :param scale: Side length relative to 21600 x 43200.
+    :param seed: Seed of the raster.
+    :return: None
+    """
+    os.makedirs(directory, exist_ok=True)
+    CONFIG.INSTANCE_DIR = directory
+    tile = max(1, round(10800 * scale))
+    rng = np.random.default_rng(seed)
+    dm = DataManipulator()
+    dm._data_raw = [rng.gamma(.5, 200, (tile, tile)).astype(np.float32)
+                    for _ in range(8)]
+    dm.process()
+    dm.save()
+
+
+def regular_polygon(center, radius: float, n: int) -> List[List[int]]:
+    """
+    Vertices of a regular polygon, rounded to the grid.
+
+    :param center: ``(x, y)`` of the center.
+    :param radius: Distance of the vertices to the center.
+    :param n: Number of vertices.
+    :return: List of ``[x, y]``.
+    """
+    angles = np.arange(n) * 2 * math.pi / n
+    return np.stack((center[0] + radius * np.cos(angles),
+                     center[1] + radius * np.sin(angles)), -1) \
+        .round().astype(int).tolist()
+
+
+def measure(func: Callable, repeat: int = 5,
+            min_time: float = .05) -> Dict[str, Any]:
+    """
+    Time ``func()``, calling it in loops of at least ``min_time`` seconds.
+
+    :param func: Function without arguments.
+    :param repeat: Number of loops.
+    :param min_time: Minimum duration of a loop.
+    :return: Seconds per call, as ``min``, ``median`` and ``mean`` over the
+             loops, and the number of calls per loop.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+        'number': number,
+    }
+
+
+def bench_algo(data_accessor, repeat: int,
+               min_time: float) -> Iterable[Dict[str, Any]]:
+    from projection import Point2D, Polygon
+    from server.algo import (ENGINES, calc_convex, calc_grid,
+                             point_in_convex, points_in_convex)
+
+    rows, cols = data_accessor._data_processed.shape
+    center = (rows // 2, cols // 2)
+    rng = np.random.default_rng(0)
+    probes = np.stack((rng.integers(0, rows, 1000),
+                       rng.integers(0, cols, 1000)), -1)
+
+    def record(name, timing, **params):
+        logging.info(f'{name} {params}: {timing["median"] * 1e6:.1f} us')
+        return {'name': name, 'params': params, **timing}
+
+    for radius in RADII:
+        for n in VERTICES:
+            points = regular_polygon(center, radius * rows, n)
+            params = {'radius': radius, 'vertices': n}
+            polygon = calc_convex(Polygon(points))
+            probe = Point2D(*center)
+
+            yield record('calc_convex', measure(
+                lambda: calc_convex(Polygon(points)), repeat, min_time
+            ), **params)
+            yield record('point_in_convex', measure(
+                lambda: point_in_convex(probe, polygon), repeat, min_time
+            ), **params)
+            yield record('points_in_convex', measure(
+                lambda: points_in_convex(probes, polygon), repeat, min_time
+            ), **params, points=len(probes))
+            for engine, func in ENGINES.items():
+                yield record(f'calc_whole_convex[{engine}]', measure(
+                    lambda: func(polygon, data_accessor), repeat, min_time
+                ), **params)
+
+            width = max(1, round(2 * radius * rows / GRID_CELLS))
+            bounds = (center[0] - radius * rows, center[0] + radius * rows,
+                      center[1] - radius * rows, center[1] + radius * rows)
+            bounds = tuple(int(v) for v in bounds)
+            yield record('calc_grid', measure(
+                lambda: calc_grid(polygon, *bounds, width, data_accessor),
+                repeat, min_time
+            ), **params, width=width)
+
+    spans = rng.integers(0, cols, (1000, 2))
+    spans.sort(axis=1)
+    spans = np.column_stack((rng.integers(0, rows, 1000), spans)).tolist()
+
+    def query():
+        for row, start, end in spans:
+            data_accessor.query(row, start, end)
+
+    timing = measure(query, repeat, min_time)
+    yield record('DataAccessor.query', {
+        k: v / len(spans) if k != 'number' else v for k, v in timing.items()
+    })
+
+
+async def _bench_handlers(repeat: int) -> List[Dict[str, Any]]:
+    from server.server import create_app
+    import aiohttp
+
+    cache_size, CONFIG.CACHE_SIZE = CONFIG.CACHE_SIZE, 0
+    try:
+        # measure the queries, not the result cache
+        app = create_app(CONFIG)
+    finally:
+        CONFIG.CACHE_SIZE = cache_size
+    # the handlers log every request, keep the output readable
+    sanic_logger = logging.getLogger('sanic.root')
+    level = sanic_logger.level
+    sanic_logger.setLevel(logging.WARNING)
+    server = await app.create_server(host='127.0.0.1', port=0,
+                                     return_asyncio_server=True)
+    await server.startup()
+    await server.before_start()
+    url = 'http://127.0.0.1:{}'.format(
+        server.server.sockets[0].getsockname()[1]
+    )
+
+    rows, cols = app.ctx.data_accessor._data_processed.shape
+    center = (rows // 2, cols // 2)
+    records = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def post(path, data):
+                # a failing handler answers quickly, and would pass for a
+                # fast one
+                async with session.post(url + path, json=data) as response:
+                    if response.status != 200:
+                        raise RuntimeError(
+                            f'POST {path}: HTTP {response.status}'
+                        )
+                    body = await response.json()
+                    if 'error' in body:
+                        raise RuntimeError(f'POST {path}: {body["error"]}')
+                    return body
+
+            for radius in RADII:
+                for n in VERTICES:
+                    geometry = {'type': 'Polygon', 'coordinates': [
+                        regular_polygon(center, radius * rows, n)
+                    ]}
+                    width = max(1, round(2 * radius * rows / GRID_CELLS))
+                    for path, data in (
+                            ('/api/total', {'geometry': geometry,
+                                            'mode': 'convex'}),
+                            ('/api/grid', {'geometry': geometry,
+                                           'grid_width': width}),
+                    ):
+                        times = []
+                        for _ in range(repeat):
+                            start = time.perf_counter()
+                            await post(path, data)
+                            times.append(time.perf_counter() - start)
+                        records.append({
+                            'name': f'POST {path}',
+                            'params': {'radius': radius, 'vertices': n},
+                            'min': min(times),
+                            'median': statistics.median(times),
+                            'mean': statistics.fmean(times),
+                            'number': 1,
+                        })
+    finally:
+        await server.before_stop()
+        await server.close()
+        await server.after_stop()
+        sanic_logger.setLevel(level)
+    return records
+
+
+def run(scale: float = .1, repeat: int = 5, handlers: bool = True,
+        directory: str = None, min_time: float = .05) -> Dict[str, Any]:
+    """
+    Run the suite.
+
+    :param scale: Raster size relative to GPW, see `make_instance`.
+    :param repeat: Timed loops per benchmark.
+    :param handlers: Also time the HTTP handlers through a local server.
+    :param directory: Instance directory, a temporary one if None.
+    :param min_time: Minimum duration of a timed loop, see `measure`.
+    :return: Results: ``meta`` describing the run and ``results``.
+    """
+    import tempfile
+
+    instance_dir = CONFIG.INSTANCE_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = directory or tmp
+        if not os.path.exists(os.path.join(directory, CONFIG.DATA_FILE)):
+            logging.info(f'Generating a raster of scale {scale}...')
+            make_instance(directory, scale)
+        CONFIG.INSTANCE_DIR = directory
+        try:
+            from server.algo import DataAccessor
+            data_accessor = DataAccessor()
+            shape = data_accessor._data_processed.shape
+            results = list(bench_algo(data_accessor, repeat, min_time))
+            del data_accessor
+            if handlers:
+                results += asyncio.run(_bench_handlers(repeat))
+        finally:
+            CONFIG.INSTANCE_DIR = instance_dir
+
+    return {
+        'meta': {
+            'shape': list(shape),
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def _key(record):
+    return record['name'], json.dumps(record['params'], sort_keys=True)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any],
+            threshold: float = 1.1) -> List[Dict[str, Any]]:
+    """
+    Compare the median times of two runs.
+
+    :param baseline: Results of `run`.
+    :param current: Results of `run`.
+    :param threshold: Ratio beyond which a benchmark counts as changed.
+    :return: One entry per common benchmark, with the ``ratio`` of current
+             to baseline time and whether it ``regressed`` or ``improved``.
+    """
+    old = {_key(r): r for r in baseline['results']}
+    ret = []
+    for record in current['results']:
+        base = old.get(_key(record))
+        if base is None:
+            continue
+        ratio = record['median'] / base['median']
+        ret.append({
+            'name': record['name'],
+            'params': record['params'],
+            'ratio': ratio,
+            'regressed': ratio > threshold,
+            'improved': ratio < 1 / threshold,
+        })
+    return ret
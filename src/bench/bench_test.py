@@ -0,0 +1,65 @@
+from .bench import *
+
+from sanic import Sanic
+from unittest import mock
+
+import unittest
+
+
+class BenchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # the runs with handlers create their own app under the same name
+        Sanic.test_mode = True
+
+    def test_regular_polygon(self):
+        self.assertEqual([[10, 20], [5, 25], [0, 20], [5, 15]],
+                         regular_polygon((5, 20), 5, 4))
+
+    def test_measure(self):
+        calls = []
+        timing = measure(lambda: calls.append(1), repeat=3, min_time=0)
+        self.assertEqual(3, len(calls))
+        self.assertEqual(1, timing['number'])
+        self.assertLessEqual(timing['min'], timing['median'])
+
+    def test_run(self):
+        results = run(scale=.005, repeat=1, min_time=0)
+        self.assertEqual([108, 216], results['meta']['shape'])
+        names = {r['name'] for r in results['results']}
+        for name in ('calc_convex', 'point_in_convex',
+                     'calc_whole_convex[legacy]', 'calc_grid',
+                     'DataAccessor.query', 'POST /api/total',
+                     'POST /api/grid'):
+            self.assertIn(name, names)
+        json.dumps(results)
+
+        entries = compare(results, results)
+        self.assertEqual(len(results['results']), len(entries))
+        self.assertFalse(any(e['regressed'] or e['improved']
+                             for e in entries))
+
+    def test_handler_error(self):
+        def calc_grid(*args):
+            raise ValueError('Grid failed.')
+
+        with mock.patch('server.server.calc_grid', calc_grid):
+            with self.assertRaisesRegex(RuntimeError, 'Grid failed.'):
+                run(scale=.005, repeat=1, min_time=0)
+
+    def test_compare(self):
+        def results(*times):
+            return {'results': [
+                {'name': 'f', 'params': {'n': n}, 'median': t}
+                for n, t in enumerate(times)
+            ]}
+
+        entries = compare(results(1, 1, 1), results(2, 1, .5))
+        self.assertEqual([True, False, False],
+                         [e['regressed'] for e in entries])
+        self.assertEqual([False, False, True],
+                         [e['improved'] for e in entries])
+
+
+if __name__ == '__main__':
+    unittest.main()
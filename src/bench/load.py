@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load generator: replays requests against a running server and reports
+throughput and latency percentiles per endpoint.
+"""
+
+from .bench import regular_polygon
+
+from typing import Any, Dict, Iterable, List, Tuple
+
+import ast
+import asyncio
+import json
+import logging
+import numpy as np
+import re
+import time
+
+Request = Tuple[str, Dict[str, Any]]
+
+# a request logged by the server, e.g. "/api/total: {'geometry': ...}"
+LOG_LINE = re.compile(r'(/api/[\w/]+): (\{.*\})\s*$')
+# a list shortened by `util.summarize`, e.g. "[[0, 0], '... 97 more']"
+SUMMARIZED = re.compile(r"'\.\.\. \d+ more'")
+
+
+def load_requests(file: str) -> List[Request]:
+    """
+    Read requests to replay, one per line, either as JSON objects with
+    ``path`` and ``body``, or as request lines of the server log. Only logs
+    of a server run with ``--log-payload-limit 0`` have whole payloads,
+    summarized ones are skipped.
+
+    :param file: Path of the file.
+    :return: List of ``(path, body)``.
+    """
+    ret = []
+    with open(file) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            match = LOG_LINE.search(line)
+            try:
+                if match and not SUMMARIZED.search(match[2]):
+                    ret.append((match[1], ast.literal_eval(match[2])))
+                    continue
+                request = json.loads(line)
+                ret.append((request['path'], request['body']))
+            except (ValueError, KeyError, TypeError, SyntaxError):
+                logging.warning(f'Skipping unreadable request: {line[:80]}')
+    return ret
+
+
+def random_requests(n: int, shape: Tuple[int, int] = (21600, 43200),
+                    grid_ratio: float = .2, seed: int = 0) -> List[Request]:
+    """
+    Generate random convex polygons of random size and vertex count.
+
+    :param n: Number of requests.
+    :param shape: Shape of the raster.
+    :param grid_ratio: Fraction of ``/api/grid`` requests, the rest are
+                       ``/api/total``.
+    :param seed: Seed of the generator.
+    :return: List of ``(path, body)``.
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = shape
+    ret = []
+    for _ in range(n):
+        radius = rows * 10 ** rng.uniform(-3, -.7)
+        center = (rng.uniform(radius, rows - radius),
+                  rng.uniform(radius, cols - radius))
+        geometry = {'type': 'Polygon', 'coordinates': [
+            regular_polygon(center, radius, int(rng.integers(3, 64)))
+        ]}
+        if rng.random() < grid_ratio:
+            ret.append(('/api/grid', {
+                'geometry': geometry,
+                'grid_width': max(1, round(radius / 25))
+            }))
+        else:
+            ret.append(('/api/total', {'geometry': geometry,
+                                       'mode': 'convex'}))
+    return ret
+
+
+async def run_load(client, requests: Iterable[Request],
+                   concurrency: int = 8, rate: float = 0) -> Dict[str, Any]:
+    """
+    Send requests and time them.
+
+    Without a ``rate``, ``concurrency`` workers send the next request as soon
+    as their last one is answered. With a ``rate``, requests start on a fixed
+    schedule whatever the server's speed, at most ``concurrency`` in flight,
+    and are timed from their scheduled start, so that the time spent waiting
+    behind slow requests counts as it would for clients on that schedule.
+
+    :param client: Object with an async ``post(path, body)``, e.g. a
+                   PopulationClient.
+    :param requests: ``(path, body)`` to send, in order.
+    :param concurrency: Maximum number of requests in flight.
+    :param rate: Requests started per second, 0 for as fast as possible.
+    :return: Report, see `summarize`.
+    """
+    requests = list(requests)
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(path, body, scheduled: float = None):
+        async with semaphore:
+            start = time.perf_counter() if scheduled is None else scheduled
+            try:
+                response = await client.post(path, body)
+                failed = isinstance(response, dict) and 'error' in response
+            except Exception as e:
+                logging.debug(f'{path}: {e.__repr__()}')
+                failed = True
+            latencies.setdefault(path, []).append(
+                time.perf_counter() - start
+            )
+            errors[path] = errors.get(path, 0) + failed
+
+    start = time.perf_counter()
+    if rate > 0:
+        tasks = []
+        for i, request in enumerate(requests):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(*request, scheduled)))
+        await asyncio.gather(*tasks)
+    else:
+        queue = iter(requests)
+
+        async def worker():
+            for request in queue:
+                await send(*request)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def summarize(latencies: Dict[str, List[float]], errors: Dict[str, int],
+              elapsed: float) -> Dict[str, Any]:
+    """
+    Throughput and latency percentiles per endpoint and over all of them.
+
+    :param latencies: Seconds of every request, per path.
+    :param errors: Number of failed requests, per path.
+    :param elapsed: Seconds the whole run took.
+    :return: ``{path: stats}``, plus ``all``; latencies in milliseconds.
+    """
+    def stats(times, failed):
+        p50, p95, p99 = np.percentile(times, (50, 95, 99)) * 1000 \
+            if times else (0, 0, 0)
+        return {
+            'requests': len(times),
+            'errors': failed,
+            'throughput': len(times) / elapsed if elapsed > 0 else 0,
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99),
+        }
+
+    ret = {path: stats(times, errors.get(path, 0))
+           for path, times in sorted(latencies.items())}
+    ret['all'] = stats([t for times in latencies.values() for t in times],
+                       sum(errors.values()))
+    ret['all']['seconds'] = elapsed
+    return ret
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f'{"endpoint":<20} {"requests":>8} {"errors":>6} {"req/s":>8} '
+             f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}']
+    for path, s in report.items():
+        lines.append(f'{path:<20} {s["requests"]:>8} {s["errors"]:>6} '
+                     f'{s["throughput"]:>8.1f} {s["p50_ms"]:>8.2f} '
+                     f'{s["p95_ms"]:>8.2f} {s["p99_ms"]:>8.2f}')
+    return '\n'.join(lines)
@@ -0,0 +1,85 @@
+from .load import *
+
+import os
+import tempfile
+import unittest
+
+
+class FakeClient:
+    def __init__(self):
+        self.running = self.peak = 0
+        self.sent = []
+
+    async def post(self, path, body):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(body.get('sleep', .001))
+        self.running -= 1
+        self.sent.append((path, body))
+        if body.get('fail'):
+            raise ConnectionError()
+        return {'error': 'bad'} if body.get('error') else {'population': 1}
+
+
+class LoadTest(unittest.TestCase):
+    def test_load_requests(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, 'requests.jsonl')
+            with open(file, 'w') as f:
+                f.write('[2026-01-01 00:00:00 +0000] [1] [INFO] /api/total: '
+                        "{'geometry': {'coordinates': [[(0, 0)]]}}\n"
+                        '\n'
+                        '[2026-01-01 00:00:00 +0000] [1] [INFO] /api/total: '
+                        "{'geometry': {'coordinates': [[[0, 0], [1, 1], "
+                        "[2, 2], '... 97 more']]}}\n"
+                        '[2026-01-01 00:00:00 +0000] [1] [INFO] /api/total: '
+                        "{'geometry': Polygon(...)}\n"
+                        '{"path": "/api/grid", "body": {"grid_width": 2}}\n'
+                        'garbage\n')
+            self.assertEqual([
+                ('/api/total', {'geometry': {'coordinates': [[(0, 0)]]}}),
+                ('/api/grid', {'grid_width': 2}),
+            ], load_requests(file))
+
+    def test_random_requests(self):
+        requests = random_requests(50, (1000, 2000))
+        self.assertEqual(requests, random_requests(50, (1000, 2000)))
+        self.assertEqual({'/api/total', '/api/grid'},
+                         {path for path, _ in requests})
+        for path, body in requests:
+            points = np.array(body['geometry']['coordinates'][0])
+            self.assertTrue((points >= 0).all())
+            self.assertTrue((points.max(axis=0) <= (1000, 2000)).all())
+
+    def test_run_load(self):
+        requests = [('/api/total', {}), ('/api/total', {'error': True}),
+                    ('/api/grid', {'fail': True})] * 10
+        client = FakeClient()
+        report = asyncio.run(run_load(client, requests, concurrency=4))
+        self.assertEqual(4, client.peak)
+        self.assertEqual(30, len(client.sent))
+        self.assertEqual((20, 10), (report['/api/total']['requests'],
+                                    report['/api/total']['errors']))
+        self.assertEqual((10, 10), (report['/api/grid']['requests'],
+                                    report['/api/grid']['errors']))
+        self.assertEqual(30, report['all']['requests'])
+        self.assertLessEqual(report['all']['p50_ms'],
+                             report['all']['p99_ms'])
+        self.assertIn('/api/grid', format_report(report))
+
+    def test_run_load_rate(self):
+        client = FakeClient()
+        report = asyncio.run(run_load(client, [('/api/total', {})] * 10,
+                                      rate=200))
+        self.assertEqual(10, len(client.sent))
+        self.assertGreaterEqual(report['all']['seconds'], 9 / 200)
+
+        # the requests queued behind a slow one are late on the schedule
+        report = asyncio.run(run_load(client, [('/api/total',
+                                                {'sleep': .05})] * 5,
+                                      concurrency=1, rate=200))
+        self.assertGreaterEqual(report['all']['p99_ms'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
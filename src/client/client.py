@@ -1,17 +1,18 @@
 # -*- coding: utf-8 -*-
-import threading
 
 from .requests import *
 from config.project_meta import __project__
-from projection import Point2D, Point3D, project
+from projection import Point2D, Point3D, project_points
 
 from tkinter import messagebox, simpledialog
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from functools import partial
 
 import numpy as np
 import tkinter as tk
 import matplotlib.pyplot as plt
 import logging
+import time
 
 
 class AddPointDialog(simpledialog.Dialog):
@@ -46,6 +47,9 @@ class AddPointDialog(simpledialog.Dialog):
 
 
 class Client(tk.Tk):
+    POLL_INTERVAL = 50  # ms between checks for finished requests
+    REDRAW_INTERVAL = .2  # s between redraws of a streamed grid
+
     def __init__(self, addr, port):
         super().__init__()
 
@@ -63,12 +67,17 @@ class Client(tk.Tk):
         self.setup_ui()
         self.mock_data()
 
-        self.loop = asyncio.new_event_loop()
-        threading.Thread(target=self.run_loop, args=(self.loop,))
+        self.api = PopulationClient(f'{addr}:{port}')
+        self.protocol('WM_DELETE_WINDOW', self.close)
+        self.poll_responses()
+
+    def poll_responses(self):
+        self.api.run_callbacks()
+        self.after(self.POLL_INTERVAL, self.poll_responses)
 
-    def run_loop(self, loop):
-        asyncio.set_event_loop(loop)
-        loop.run_forever()
+    def close(self):
+        self.api.close()
+        self.destroy()
 
     def mock_data(self):
         mock_coord = (
@@ -135,7 +144,7 @@ class Client(tk.Tk):
 
         self.request_total_button = tk.Button(
             self, text='查询总人口数',
-            command=lambda: self.loop.run_until_complete(self.request_total())
+            command=self.request_total
         )
         self.request_total_button.grid(
             row=4, column=1, padx=5, sticky='ew'
@@ -143,7 +152,7 @@ class Client(tk.Tk):
 
         self.request_grid_button = tk.Button(
             self, text='绘制热力图',
-            command=lambda: self.loop.run_until_complete(self.request_grid())
+            command=self.request_grid
         )
         self.request_grid_button.grid(
             row=5, column=1, padx=5, sticky='ew'
@@ -165,23 +174,21 @@ class Client(tk.Tk):
         except IndexError:
             messagebox.showerror('出错了！', '没有选中坐标点。')
 
-    async def request_total(self):
-        geojson = encap_geojson([project(p) for p in self.points])
-        logging.info(f'Requesting total population: {geojson}')
-        url = f'{self.server[0]}:{self.server[1]}/api/total'
-        response = await request(url, {'geometry': geojson})
+    def request_total(self):
+        points2d = project_points(self.points)
+        logging.info(f'Requesting total population: {points2d}')
+        self.api.submit(self.api.total(points2d), self.show_total)
 
-        logging.info(f'Response: {response}')
-        if 'error' in response:
-            messagebox.showerror('出错了！', response['error'])
-        else:
+    def show_total(self, future):
+        response = self.get_response(future)
+        if response is not None:
             messagebox.showinfo(
                 '总人口',
                 f'总人口: {int(response["population"])}'
             )
 
-    async def request_grid(self):
-        points2d = [project(p) for p in self.points]
+    def request_grid(self):
+        points2d = project_points(self.points)
         max_x = max(p.x for p in points2d)
         min_x = min(p.x for p in points2d)
         max_y = max(p.y for p in points2d)
@@ -189,26 +196,65 @@ class Client(tk.Tk):
         grid_count = min(100, max(max_x - min_x, max_y - min_y) // 3)
         width = max(1, (max_x - min_x) // grid_count)
 
-        geojson = encap_geojson([project(p) for p in self.points])
-        logging.info(f'Requesting grid population: {geojson}')
-        url = f'{self.server[0]}:{self.server[1]}/api/grid'
-        response = await request(url, {
-            'geometry': geojson,
-            'grid_width': width
-        })
+        logging.info(f'Requesting grid population: {points2d}')
+        self.api.submit(self.stream_grid(points2d, width),
+                        partial(self.show_grid, width))
+
+    async def stream_grid(self, points2d, width):
+        """
+        Receive a grid row by row on the client loop, redrawing the partial
+        heatmap at most every `REDRAW_INTERVAL` seconds.
+        """
+        grid = origin = None
+        last_draw = 0
+        async for message in self.api.grid_stream(points2d, width):
+            if 'error' in message:
+                return message
+            if 'shape' in message:
+                grid = np.full(message['shape'], -1.)
+                origin = message.get('origin')
+                continue
+            grid[message['row']] = message['values']
+            if time.monotonic() - last_draw > self.REDRAW_INTERVAL:
+                last_draw = time.monotonic()
+                self.api.call_soon(self.plot_data, grid.copy(), origin,
+                                   width)
+        return {'grid': grid, 'origin': origin}
+
+    def show_grid(self, width, future):
+        response = self.get_response(future)
+        if response is not None:
+            self.plot_data(response['grid'], response.get('origin'), width)
+
+    def get_response(self, future):
+        try:
+            response = future.result()
+        except Exception as e:
+            logging.error(f'Request failed: {e.__repr__()}')
+            messagebox.showerror('出错了！', f'请求失败！\n{e}')
+            return None
 
         logging.info(f'Response: {response}')
         if 'error' in response:
             messagebox.showerror('出错了！', response['error'])
-        else:
-            self.plot_data(response['grid'])
-
-    def plot_data(self, data):
+            return None
+        return response
+
+    def plot_data(self, data, origin=None, width=None):
+        """
+        Draw a grid as a heatmap.
+
+        :param data: Matrix of cell sums, -1 outside the convex.
+        :param origin: Projected corner of the first cell, as returned by the
+                       server, which may lie before the bounding box of the
+                       points. None to spread the cells over the box.
+        :param width: Side length of a cell, needed with ``origin``.
+        """
         max_lat = max(p.latitude for p in self.points)
         min_lat = min(p.latitude for p in self.points)
         max_lon = max(p.longitude for p in self.points)
         min_lon = min(p.longitude for p in self.points)
-        data = np.array(data)
+        data = np.asarray(data, dtype=np.float64)
         data = np.where(data == -1, np.nan, data)
         data = np.log2(data, out=np.zeros_like(data), where=(data != 0))
 
@@ -226,6 +272,22 @@ class Client(tk.Tk):
 
             lon_sticks = np.linspace(min_lon, max_lon, data.shape[1])
             lat_sticks = np.linspace(min_lat, max_lat, data.shape[0])
+            if origin is not None:
+                # label the cell centers, mapping projected coordinates
+                # linearly through the extremes of the points
+                points2d = project_points(self.points)
+
+                def degrees(start, n, coords, lo, hi):
+                    centers = start + (np.arange(n) + .5) * width
+                    span = max(coords) - min(coords) or 1
+                    return lo + (centers - min(coords)) * (hi - lo) / span
+
+                lat_sticks = degrees(origin[0], data.shape[0],
+                                     [p.x for p in points2d],
+                                     min_lat, max_lat)
+                lon_sticks = degrees(origin[1], data.shape[1],
+                                     [p.y for p in points2d],
+                                     min_lon, max_lon)
             ax.set_xticklabels([f'{x:.3g}' for x in lon_sticks])
             ax.set_yticklabels([f'{x:.3g}' for x in lat_sticks])
             ax.tick_params(axis='both', labelsize=6)
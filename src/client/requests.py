@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 
 from projection import Point2D
+from util.codec import NPY_MIME, ORIGIN_HEADER, decode_npy
 
-from typing import Any, Dict, List
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
 
 import aiohttp
 import asyncio
 import json
+import queue
+import threading
 
 
 def encap_geojson(points2d: List[Point2D]) -> Dict[str, Any]:
@@ -22,9 +26,211 @@ def encap_geojson(points2d: List[Point2D]) -> Dict[str, Any]:
     }
 
 
-async def request(url, data):
-    if not url.startswith('http://'):
-        url = 'http://' + url
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=data) as response:
-            return await response.json()
+def encap_feature_collection(
+        polygons: Iterable[List[Point2D]]
+) -> Dict[str, Any]:
+    """
+    Encapsulate many polygons in a GeoJSON FeatureCollection.
+
+    :param polygons: Lists of Point2D objects.
+    :return: GeoJSON FeatureCollection.
+    """
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'geometry': encap_geojson(points2d)}
+            for points2d in polygons
+        ]
+    }
+
+
+class PopulationClient:
+    """
+    Client of the server API that keeps one pooled, keep-alive session on
+    its own event loop thread.
+
+    Coroutines such as `total` are scheduled on that loop with `submit`, so
+    they never block the calling thread; a GUI collects the results on its
+    own thread with `run_callbacks`. Scripts may simply call `call`.
+    """
+
+    def __init__(self, server: str, limit: int = 8):
+        """
+        :param server: ``addr:port`` of the server, optionally with scheme.
+        :param limit: Maximum number of requests in flight.
+        """
+        if not server.startswith('http://'):
+            server = 'http://' + server
+        self.server = server
+        self.limit = limit
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._callbacks = queue.SimpleQueue()
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _open(self):
+        # both must be created on the loop thread
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.limit)
+        )
+        self._semaphore = asyncio.Semaphore(self.limit)
+
+    async def post(self, path: str, data: Dict[str, Any],
+                   accept: str = None) -> Any:
+        """
+        Post JSON to the server, waiting while `limit` requests are running.
+
+        :param path: Path of the API, e.g. ``/api/total``.
+        :param data: JSON body.
+        :param accept: Preferred response type, e.g. ``NPY_MIME``.
+        :return: Decoded JSON response. A ``.npy`` grid is returned as
+                 ``{'grid': array, 'origin': [x, y]}`` likewise.
+        """
+        if self._session is None:
+            self._open()
+        headers = {'Accept': accept} if accept else None
+        async with self._semaphore:
+            async with self._session.post(self.server + path, json=data,
+                                          headers=headers) as response:
+                if response.content_type == NPY_MIME:
+                    ret = {'grid': decode_npy(await response.read())}
+                    if ORIGIN_HEADER in response.headers:
+                        ret['origin'] = [
+                            float(v) for v in
+                            response.headers[ORIGIN_HEADER].split(',')
+                        ]
+                    return ret
+                return await response.json()
+
+    async def total(self, points2d: List[Point2D]) -> Dict[str, Any]:
+        return await self.post('/api/total', {
+            'geometry': encap_geojson(points2d),
+            'mode': 'convex'
+        })
+
+    async def grid(self, points2d: List[Point2D], width: int,
+                   binary: bool = True) -> Dict[str, Any]:
+        """
+        Request the grid of a convex.
+
+        :param points2d: Vertices.
+        :param width: Side length of a cell.
+        :param binary: Receive the grid as float32 ``.npy`` bytes instead of
+                       JSON lists.
+        :return: Response, whose ``grid`` is an array if ``binary``, and
+                 ``origin`` the corner of its first cell.
+        """
+        return await self.post('/api/grid', {
+            'geometry': encap_geojson(points2d),
+            'grid_width': width
+        }, accept=NPY_MIME if binary else None)
+
+    async def grid_stream(self, points2d: List[Point2D], width: int):
+        """
+        Request the grid of a convex from ``/api/grid/stream``, yielding the
+        messages as they arrive: ``{'shape': ..., 'origin': ...}`` first,
+        then one ``{'row': i, 'values': [...]}`` per grid row, or
+        ``{'error': ...}``.
+
+        :param points2d: Vertices.
+        :param width: Side length of a cell.
+        """
+        if self._session is None:
+            self._open()
+        data = {
+            'geometry': encap_geojson(points2d),
+            'grid_width': width
+        }
+        url = self.server + '/api/grid/stream'
+        async with self._semaphore:
+            async with self._session.post(url, json=data) as response:
+                if response.content_type != 'application/x-ndjson':
+                    yield await response.json()
+                    return
+                async for line in response.content:
+                    if line.strip():
+                        yield json.loads(line)
+
+    async def batch(self, polygons: Iterable[List[Point2D]]) -> Dict[str, Any]:
+        return await self.post('/api/total/batch', {
+            **encap_feature_collection(polygons), 'mode': 'convex'
+        })
+
+    async def fan_out(self, path: str,
+                      payloads: Iterable[Dict[str, Any]]) -> List[Any]:
+        """
+        Post many requests concurrently, at most `limit` at a time.
+
+        :param path: Path of the API.
+        :param payloads: JSON bodies.
+        :return: Responses, in the order of `payloads`. A failed request
+                 gives its exception instead.
+        """
+        return await asyncio.gather(
+            *(self.post(path, data) for data in payloads),
+            return_exceptions=True
+        )
+
+    def submit(self, coro: Awaitable,
+               callback: Callable[[Future], Any] = None) -> Future:
+        """
+        Run a coroutine on the client loop without waiting for it.
+
+        :param coro: Coroutine, e.g. ``client.total(points)``.
+        :param callback: Called with the finished future by the next
+                         `run_callbacks` on the caller's thread.
+        :return: Future of the result.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if callback is not None:
+            future.add_done_callback(lambda f: self.call_soon(callback, f))
+        return future
+
+    def call_soon(self, callback: Callable, *args):
+        """
+        Queue ``callback(*args)`` for the next `run_callbacks`, e.g. to show
+        partial results from a coroutine.
+
+        :return: None
+        """
+        self._callbacks.put((callback, args))
+
+    def call(self, coro: Awaitable) -> Any:
+        """
+        Run a coroutine on the client loop and wait for its result.
+        """
+        return self.submit(coro).result()
+
+    def run_callbacks(self):
+        """
+        Run the callbacks of all finished submissions and all queued by
+        `call_soon`. A GUI calls this periodically from its own thread, e.g.
+        with Tk's ``after``.
+
+        :return: None
+        """
+        while True:
+            try:
+                callback, args = self._callbacks.get_nowait()
+            except queue.Empty:
+                return
+            callback(*args)
+
+    def close(self):
+        """
+        Close the session and stop the loop thread.
+
+        :return: None
+        """
+        if self._session is not None:
+            self.call(self._session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
@@ -0,0 +1,130 @@
+from .requests import *
+from util.codec import ORIGIN_HEADER, encode_npy
+
+from aiohttp import web
+
+import numpy as np
+import time
+import unittest
+
+
+class PopulationClientTest(unittest.TestCase):
+    """
+    Runs a small aiohttp server on its own loop thread that echoes the
+    request and records how many requests were in flight at once.
+    """
+
+    def setUp(self):
+        self.running = self.peak = 0
+        self.grid = np.arange(6.).reshape(2, 3) - 1
+
+        async def handler(request):
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            await asyncio.sleep(.01)
+            self.running -= 1
+            return web.json_response({'echo': await request.json()})
+
+        async def grid_handler(request):
+            if request.headers.get('Accept') == NPY_MIME:
+                return web.Response(body=encode_npy(self.grid),
+                                    content_type=NPY_MIME,
+                                    headers={ORIGIN_HEADER: '-4,8'})
+            return web.json_response({'grid': self.grid.tolist(),
+                                      'origin': [-4, 8]})
+
+        async def stream_handler(request):
+            response = web.StreamResponse()
+            response.content_type = 'application/x-ndjson'
+            await response.prepare(request)
+            await response.write(
+                json.dumps({'shape': self.grid.shape}).encode() + b'\n'
+            )
+            for i, row in enumerate(self.grid.tolist()):
+                await response.write(
+                    json.dumps({'row': i, 'values': row}).encode() + b'\n'
+                )
+            await response.write_eof()
+            return response
+
+        async def start():
+            app = web.Application()
+            app.router.add_post('/api/total', handler)
+            app.router.add_post('/api/grid', grid_handler)
+            app.router.add_post('/api/grid/stream', stream_handler)
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            site = web.TCPSite(self.runner, '127.0.0.1', 0)
+            await site.start()
+            return site._server.sockets[0].getsockname()[1]
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        port = asyncio.run_coroutine_threadsafe(start(), self.loop).result()
+        self.client = PopulationClient(f'127.0.0.1:{port}', limit=3)
+
+    def tearDown(self):
+        self.client.close()
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(),
+                                         self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def test_fan_out(self):
+        payloads = [{'i': i} for i in range(20)]
+        responses = self.client.call(
+            self.client.fan_out('/api/total', payloads)
+        )
+        self.assertEqual([{'echo': data} for data in payloads], responses)
+        self.assertLessEqual(self.peak, 3)
+
+    def test_grid(self):
+        points = [Point2D(0, 0), Point2D(1, 0), Point2D(0, 1)]
+        binary = self.client.call(self.client.grid(points, 1))
+        self.assertIsInstance(binary['grid'], np.ndarray)
+        np.testing.assert_array_equal(self.grid, binary['grid'])
+        self.assertEqual([-4, 8], binary['origin'])
+        self.assertEqual(
+            {'grid': self.grid.tolist(), 'origin': [-4, 8]},
+            self.client.call(self.client.grid(points, 1, False))
+        )
+
+    def test_grid_stream(self):
+        async def collect():
+            return [message async for message in self.client.grid_stream(
+                [Point2D(0, 0), Point2D(1, 0), Point2D(0, 1)], 1
+            )]
+
+        self.assertEqual(
+            [{'shape': [2, 3]},
+             {'row': 0, 'values': [-1, 0, 1]},
+             {'row': 1, 'values': [2, 3, 4]}],
+            self.client.call(collect())
+        )
+
+    def test_callbacks(self):
+        results = []
+        future = self.client.submit(
+            self.client.total([Point2D(0, 0), Point2D(1, 0), Point2D(0, 1)]),
+            lambda f: results.append(f.result())
+        )
+        future.result()
+        self.assertEqual([], results)
+        # the callback is queued right after the result is set
+        for _ in range(100):
+            self.client.run_callbacks()
+            if results:
+                break
+            time.sleep(.01)
+        self.assertEqual(
+            [{'echo': {'geometry': {
+                'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [0, 1]]]
+            }, 'mode': 'convex'}}],
+            results
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
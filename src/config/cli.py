@@ -52,11 +52,141 @@ class Cli(ArgumentParser):
             type=str,
             default=CONFIG.DEFAULT_LOG_FILE,
         )
+        self.add_argument(
+            '--log-queue',
+            action='store_true',
+            help='Write logs from a background thread',
+        )
+        self.add_argument(
+            '--log-payload-limit',
+            type=int,
+            default=CONFIG.LOG_PAYLOAD_LIMIT,
+            help='Characters of a request payload logged, 0 for all of it',
+        )
+        self.add_argument(
+            '--log-sample-rate',
+            type=float,
+            default=CONFIG.LOG_SAMPLE_RATE,
+            help='Fraction of the query requests logged at INFO',
+        )
         self.add_argument(
             '--preprocess',
             action='store_true',
             help='Preprocess data',
         )
+        self.add_argument(
+            '-b', '--bench',
+            action='store_true',
+            help='Run a load test against a server',
+        )
+        self.add_argument(
+            '--pyramid-levels',
+            type=int,
+            default=CONFIG.PYRAMID_LEVELS,
+            help='Number of down-sampled levels (2x, 4x, ...) to build',
+        )
+        self.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=CONFIG.PREPROCESS_JOBS,
+            help='Number of processes parsing the tiles, 0 for one per core',
+        )
+        self.add_argument(
+            '--precision',
+            type=str,
+            choices=('float32', 'float64'),
+            default=CONFIG.PREFIX_DTYPE,
+            help='Storage type of the row-wise prefix sums',
+        )
+        self.add_argument(
+            '--engine',
+            type=str,
+            choices=('legacy', 'sat', 'vectorized', 'exact'),
+            default=CONFIG.QUERY_ENGINE,
+            help='Query engine used by the server',
+        )
+        self.add_argument(
+            '--executor',
+            type=str,
+            choices=('thread', 'process'),
+            default=CONFIG.EXECUTOR,
+            help='Executor backend running the queries',
+        )
+        self.add_argument(
+            '--pool-size',
+            type=int,
+            default=CONFIG.POOL_SIZE,
+            help='Number of query workers, 0 for the executor default',
+        )
+        self.add_argument(
+            '--cache-size',
+            type=int,
+            default=CONFIG.CACHE_SIZE,
+            help='Number of cached query results, 0 to disable',
+        )
+        self.add_argument(
+            '--cache-ttl',
+            type=float,
+            default=CONFIG.CACHE_TTL,
+            help='Seconds a cached result stays valid, 0 for no expiry',
+        )
+        self.add_argument(
+            '--batch-chunk',
+            type=int,
+            default=CONFIG.BATCH_CHUNK,
+            help='Regions of a batch request computed per executor task',
+        )
+        self.add_argument(
+            '--tile-cache-size',
+            type=int,
+            default=CONFIG.TILE_CACHE_SIZE,
+            help='Number of map tiles cached in memory',
+        )
+        self.add_argument(
+            '--tile-disk-cache-size',
+            type=int,
+            default=CONFIG.TILE_DISK_CACHE_SIZE,
+            help='Number of map tiles cached on disk, 0 to disable',
+        )
+        self.add_argument(
+            '--admin',
+            action='store_true',
+            help='Enable the admin endpoints, e.g. /admin/profile',
+        )
+        self.add_argument(
+            '--profile-interval',
+            type=float,
+            default=CONFIG.PROFILE_INTERVAL,
+            help='Seconds between two stack samples of the profiler',
+        )
+        self.add_argument(
+            '--replay',
+            type=str,
+            help='Load test: JSONL request file or server log to replay',
+        )
+        self.add_argument(
+            '--requests',
+            type=int,
+            default=1000,
+            help='Load test: number of random polygons without --replay',
+        )
+        self.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Load test: maximum number of requests in flight',
+        )
+        self.add_argument(
+            '--rate',
+            type=float,
+            default=0,
+            help='Load test: requests started per second, 0 for no limit',
+        )
+        self.add_argument(
+            '--bench-output',
+            type=str,
+            help='Load test: write the report to this JSON file',
+        )
 
     def parse(self):
         return self.parse_args()
@@ -4,7 +4,7 @@
 Configurations for the project.
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 
 
 @dataclass
@@ -13,8 +13,34 @@ class Config:
     ASSETS_DIR: str = 'assets'
     DEFAULT_LOG_LEVEL: str = 'INFO'
     DEFAULT_LOG_FILE: str = 'run.log'
+    LOG_QUEUE: bool = False
+    LOG_PAYLOAD_LIMIT: int = 256
+    LOG_SAMPLE_RATE: float = 1
     DEFAULT_ADDR: str = '127.0.0.1'
     DEFAULT_PORT: int = 555
+    DATA_FILE: str = 'data.npy'
+    LEGACY_DATA_FILE: str = 'data.npz'
+    SAT_FILE: str = 'sat.npy'
+    PYRAMID_FILE: str = 'sat_{factor}.npy'
+    PYRAMID_LEVELS: int = 6
+    PREPROCESS_JOBS: int = 0
+    PREFIX_DTYPE: str = 'float32'
+    TILE_DIR: str = 'tiles'
+    MANIFEST_FILE: str = 'manifest.json'
+    QUERY_ENGINE: str = 'sat'
+    EXECUTOR: str = 'thread'
+    POOL_SIZE: int = 0
+    CACHE_SIZE: int = 1024
+    CACHE_TTL: float = 300
+    BATCH_CHUNK: int = 256
+    TILE_CACHE_DIR: str = 'tile_cache'
+    TILE_CACHE_SIZE: int = 256
+    TILE_DISK_CACHE_SIZE: int = 4096
+    TILE_MAX_DENSITY: float = 1e4
+    ADMIN_ENDPOINTS: bool = False
+    PROFILE_INTERVAL: float = .005
+    PROFILE_SECONDS: float = 10
+    PROFILE_MAX_SECONDS: float = 300
 
     def __getitem__(self, item):
         return getattr(self, item)
@@ -25,5 +51,16 @@ class Config:
     def __delitem__(self, key):
         return delattr(self, key)
 
+    def update(self, other: 'Config'):
+        """
+        Copy every field from another configuration, e.g. one pickled into a
+        server worker process.
+
+        :param other: Source configuration.
+        :return: None
+        """
+        for field in fields(self):
+            self[field.name] = other[field.name]
+
 
 CONFIG = Config()
@@ -1,42 +1,295 @@
 # -*- coding: utf-8 -*-
 
+from .manifest import Manifest, file_sha256
 from config import CONFIG
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import io
+import itertools
 import logging
+import multiprocessing
 import numpy as np
 import os
 
 
+def read_asc_header(f) -> dict:
+    """
+    Read the six-line header of an ESRI ASCII grid, e.g. ``ncols 10800``.
+
+    :param f: File opened in binary mode, at its beginning.
+    :return: Header values, keys in lower case.
+    """
+    header = {}
+    for _ in range(6):
+        key, value = f.readline().split()
+        header[key.decode().lower()] = float(value)
+    return header
+
+
+def iter_asc_chunks(file: str, chunk_rows: int, dtype: str = None):
+    """
+    Parse an ESRI ASCII grid ``chunk_rows`` rows at a time. NODATA cells are
+    replaced by 0.
+
+    :param file: Path of the ``.asc`` file.
+    :param chunk_rows: Number of rows per chunk.
+    :param dtype: Type the cells are parsed to, ``CONFIG.PREFIX_DTYPE`` by
+                  default, so that float64 prefix sums start from the exact
+                  values of the file.
+    :return: Generator of ``(first_row, chunk)``.
+    """
+    with open(file, 'rb') as f:
+        header = read_asc_header(f)
+        nodata = header.get('nodata_value')
+        start = 0
+        while True:
+            lines = [line for line in itertools.islice(f, chunk_rows)
+                     if not line.isspace()]
+            if not lines:
+                break
+            # the C parser of loadtxt beats fromstring on these files
+            chunk = np.loadtxt(io.BytesIO(b''.join(lines)),
+                               dtype=dtype or CONFIG.PREFIX_DTYPE, ndmin=2)
+            if nodata is not None:
+                chunk[chunk == nodata] = 0
+            yield start, chunk
+            start += len(lines)
+
+
+def _preprocess_tile(file: str, out_file: str, chunk_rows: int, dtype: str):
+    """
+    Parse a tile and stream its row-wise prefix sums into a ``.npy`` artifact,
+    atomically, so an interrupted run never leaves a partial artifact behind.
+    """
+    with open(file, 'rb') as f:
+        header = read_asc_header(f)
+    tmp = f'{out_file}.tmp'
+    out = np.lib.format.open_memmap(
+        tmp, mode='w+', dtype=dtype,
+        shape=(int(header['nrows']), int(header['ncols']))
+    )
+    for start, chunk in iter_asc_chunks(file, chunk_rows, dtype):
+        np.cumsum(chunk, axis=1, dtype=dtype,
+                  out=out[start:start + len(chunk)])
+    out.flush()
+    del out
+    os.replace(tmp, out_file)
+
+
+def _open_output(file: str, dtype, shape, start: int):
+    """
+    Open an output array, either in place to recompute it from row ``start``
+    on, or as a new temporary file when there is nothing valid to keep.
+
+    :return: ``(array, path, start)``; ``path`` differs from ``file`` if the
+             array has to be moved into place once complete.
+    """
+    if start > 0 and os.path.exists(file):
+        out = np.load(file, mmap_mode='r+')
+        if out.shape == tuple(shape) and out.dtype == dtype:
+            return out, file, start
+        del out
+    tmp = f'{file}.tmp'
+    out = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=shape)
+    return out, tmp, 0
+
+
+def _close_output(out: np.ndarray, path: str, file: str):
+    out.flush()
+    del out
+    if path != file:
+        os.replace(path, file)
+
+
 class DataManipulator:
     DATASET = 'gpw-v4-population-count-rev11_2020_30_sec_asc'
     FOLDER = os.path.join(CONFIG.ASSETS_DIR, DATASET)
     FILE_PREFIX = 'gpw_v4_population_count_rev11_2020_30_sec_'
 
+    LAYOUT = (
+        (0, 0), (0, 1), (0, 2), (0, 3),
+        (1, 0), (1, 1), (1, 2), (1, 3),
+    )
+    SAT_CHUNK_ROWS = 512
+    ASC_CHUNK_ROWS = 256
+
     def __init__(self):
         self._data_raw = []
         self._data_processed = None
+        self._data_sat = None
+        self._pyramid = {}
+
+    def tile_files(self):
+        return [
+            os.path.join(self.FOLDER, f'{self.FILE_PREFIX}{i + 1}.asc')
+            for i in range(len(self.LAYOUT))
+        ]
+
+    def preprocess(self, jobs: int = 0):
+        """
+        Incremental, streaming alternative to ``load_raw``, ``process`` and
+        ``save``.
+
+        Every tile is parsed, in parallel and chunk by chunk, into an artifact
+        of its own row-wise prefix sums named after the tile's SHA-256, so
+        unchanged tiles are never parsed twice. A band of tiles is then
+        assembled into the memory-mapped output only if the manifest says it
+        was built from other tiles, and the summed-area table and pyramid are
+        recomputed from the first changed row on. An interrupted run resumes
+        from the manifest.
+
+        :param jobs: Number of parser processes, 0 for one per core.
+        :return: None
+        """
+        files = self.tile_files()
+        with open(files[0], 'rb') as f:
+            tile = int(read_asc_header(f)['nrows'])
+        tiles_x = max(x for x, _ in self.LAYOUT) + 1
+        tiles_y = max(y for _, y in self.LAYOUT) + 1
+        rows, cols = tile * tiles_x, tile * tiles_y
+        dtype = CONFIG.PREFIX_DTYPE
+
+        tile_dir = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.TILE_DIR)
+        os.makedirs(tile_dir, exist_ok=True)
+        manifest = Manifest(
+            os.path.join(CONFIG.INSTANCE_DIR, CONFIG.MANIFEST_FILE)
+        )
+
+        with ProcessPoolExecutor(
+                max_workers=jobs or None,
+                mp_context=multiprocessing.get_context('spawn'),
+        ) as pool:
+            hashes = list(pool.map(file_sha256, files))
+            artifacts = [os.path.join(tile_dir, f'{h}_{dtype}.npy')
+                         for h in hashes]
+            futures = {
+                pool.submit(_preprocess_tile, tile_file, artifact,
+                            self.ASC_CHUNK_ROWS, dtype): tile_file
+                for tile_file, artifact in zip(files, artifacts)
+                if not os.path.exists(artifact)
+            }
+            for future in as_completed(futures):
+                future.result()
+                logging.info(f'File {os.path.basename(futures[future])} '
+                             f'parsed.')
+        logging.info(f'{len(files) - len(futures)} unchanged tiles reused.')
+
+        file = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.DATA_FILE)
+        if manifest.get('shape') != [rows, cols] \
+                or manifest.get('dtype') != dtype or not os.path.exists(file):
+            manifest['bands'] = {}
+            manifest['sat_rows'] = 0
+            manifest['pyramid'] = {}
+            np.lib.format.open_memmap(
+                file, mode='w+', dtype=dtype, shape=(rows, cols)
+            ).flush()
+            manifest['shape'] = [rows, cols]
+            manifest['dtype'] = dtype
+
+        out = np.load(file, mmap_mode='r+')
+        for x in range(tiles_x):
+            band = sorted((y, i) for i, (tx, y) in enumerate(self.LAYOUT)
+                          if tx == x)
+            band_hashes = [hashes[i] for _, i in band]
+            if manifest['bands'].get(str(x)) == band_hashes:
+                continue
+
+            # invalidate everything derived from this band before touching it
+            logging.info(f'Assembling rows {x * tile}-{(x + 1) * tile}...')
+            manifest['bands'].pop(str(x), None)
+            manifest['sat_rows'] = min(manifest['sat_rows'], x * tile)
+            manifest['pyramid'] = {
+                factor: min(valid, x * tile)
+                for factor, valid in manifest['pyramid'].items()
+            }
+            self._assemble_band(
+                out[x * tile:(x + 1) * tile],
+                [np.load(artifacts[i], mmap_mode='r') for _, i in band]
+            )
+            out.flush()
+            manifest['bands'][str(x)] = band_hashes
+            manifest.save()
+        del out
+        logging.info('Data saved.')
+
+        self._data_processed = np.load(file, mmap_mode='r')
+        logging.info(f'Sum: {self.total()}')
+
+        if not os.path.exists(os.path.join(CONFIG.INSTANCE_DIR,
+                                           CONFIG.SAT_FILE)):
+            manifest['sat_rows'] = 0
+        if manifest['sat_rows'] < rows:
+            logging.info(f'Saving summed-area table from row '
+                         f'{manifest["sat_rows"]}...')
+            self._save_sat(os.path.join(CONFIG.INSTANCE_DIR, CONFIG.SAT_FILE),
+                           self._data_processed, manifest['sat_rows'])
+            manifest['sat_rows'] = rows
+
+        sat = np.load(os.path.join(CONFIG.INSTANCE_DIR, CONFIG.SAT_FILE),
+                      mmap_mode='r')
+        for factor in self.pyramid_factors():
+            valid = manifest['pyramid'].get(str(factor), 0) \
+                if os.path.exists(self._level_file(factor)) else 0
+            if valid < rows:
+                logging.info(f'Saving pyramid level {factor}x from row '
+                             f'{valid}...')
+                self._save_level(self._level_file(factor), sat, factor, valid)
+                manifest['pyramid'][str(factor)] = rows
+                manifest.save()
+
+        for artifact in os.listdir(tile_dir):
+            if os.path.join(tile_dir, artifact) not in artifacts:
+                os.remove(os.path.join(tile_dir, artifact))
+        logging.info('Preprocessed data up to date.')
+
+    @classmethod
+    def _assemble_band(cls, out: np.ndarray, tiles):
+        """
+        Lay a band of tile prefix sums side by side, carrying the running
+        total of every row from one tile into the next.
+
+        :param out: Rows of the output covered by the band.
+        :param tiles: Row-wise prefix sums of the tiles, left to right.
+        :return: None
+        """
+        for start in range(0, out.shape[0], cls.SAT_CHUNK_ROWS):
+            end = start + cls.SAT_CHUNK_ROWS
+            col = 0
+            for data in tiles:
+                width = data.shape[1]
+                block = out[start:end, col:col + width]
+                block[:] = data[start:end]
+                if col > 0:
+                    block += out[start:end, col - 1, None]
+                col += width
 
     def load_raw(self):
         for i in range(8):
             file_name = f'{self.FILE_PREFIX}{i + 1}.asc'
             logging.info(f'Loading file {file_name}...')
             file = os.path.join(self.FOLDER, file_name)
-            data = np.loadtxt(file, skiprows=6, dtype=np.float32)
+            data = np.loadtxt(file, skiprows=6, dtype=CONFIG.PREFIX_DTYPE)
             self._data_raw.append(data)
             logging.info(f'File {file_name} loaded.')
 
     def process(self):
-        layout = (
-            (0, 0), (0, 1), (0, 2), (0, 3),
-            (1, 0), (1, 1), (1, 2), (1, 3),
-        )
+        """
+        Concatenate the raw tiles and turn them into row-wise prefix sums of
+        ``CONFIG.PREFIX_DTYPE``, in place and chunk by chunk, so no second
+        full-size temporary is allocated.
+
+        :return: None
+        """
+        tile = self._data_raw[0].shape[0]  # 10800 for the GPW dataset
         logging.info('Concatenating data...')
-        self._data_processed = np.zeros((21600, 43200), dtype=np.float32)
+        self._data_processed = np.zeros((tile * 2, tile * 4),
+                                        dtype=CONFIG.PREFIX_DTYPE)
         for i, data in enumerate(self._data_raw):
-            x, y = layout[i]
-            x *= 10800
-            y *= 10800
-            self._data_processed[x:x + 10800, y:y + 10800] = data
+            x, y = self.LAYOUT[i]
+            x *= tile
+            y *= tile
+            self._data_processed[x:x + tile, y:y + tile] = data
 
         del self._data_raw
         import gc
@@ -45,23 +298,184 @@ class DataManipulator:
         logging.info('Data concatenated.')
 
         logging.info('Transforming data...')
-        self._data_processed = np.where(
-            self._data_processed == -9999, 0, self._data_processed
-        )
-        self._data_processed = np.cumsum(self._data_processed, axis=1)
+        for start in range(0, self._data_processed.shape[0],
+                           self.SAT_CHUNK_ROWS):
+            chunk = self._data_processed[start:start + self.SAT_CHUNK_ROWS]
+            chunk[chunk == -9999] = 0
+            np.cumsum(chunk, axis=1, out=chunk)
+
+        logging.info(f'Sum: {self.total()}')
+
+    def total(self) -> float:
+        """
+        Total population, summed from the last column of the row-wise prefix
+        sums in float64, pairwise as numpy does, without a Python float per
+        row.
+
+        :return: Total population.
+        """
+        return float(np.sum(self._data_processed[:, -1], dtype=np.float64))
 
-        s = 0
-        for i in range(21600):
-            s += self._data_processed[i, -1]
-        logging.info(f'Sum: {s}')
+    @staticmethod
+    def _save_array(file: str, data: np.ndarray):
+        """
+        Save an array as an uncompressed ``.npy`` file, atomically.
+
+        :param file: Destination path.
+        :param data: Array to save.
+        :return: None
+        """
+        tmp = f'{file}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp, file)
 
     def save(self):
         logging.info('Saving preprocessed data...')
-        file = os.path.join(CONFIG.INSTANCE_DIR, 'data.npz')
-        np.savez_compressed(file, data=self._data_processed)
+        file = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.DATA_FILE)
+        self._save_array(file, self._data_processed)
         logging.info('Data saved.')
+        self._save_derived()
+
+        # the incremental pipeline no longer describes what is on disk
+        manifest = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.MANIFEST_FILE)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+
+    def _save_derived(self):
+        """
+        Save the summed-area table and the pyramid built from the row-wise
+        prefix sums.
+
+        :return: None
+        """
+        logging.info('Saving summed-area table...')
+        file = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.SAT_FILE)
+        self._save_sat(file, self._data_processed)
+        logging.info('Summed-area table saved.')
+
+        sat = np.load(file, mmap_mode='r')
+        for factor in self.pyramid_factors():
+            logging.info(f'Saving pyramid level {factor}x...')
+            self._save_level(self._level_file(factor), sat, factor)
+        logging.info('Pyramid saved.')
+
+    @staticmethod
+    def pyramid_factors():
+        """
+        Down-sampling factors of the pyramid levels: 2, 4, 8, ...
+
+        :return: List of factors.
+        """
+        return [2 ** i for i in range(1, CONFIG.PYRAMID_LEVELS + 1)]
+
+    @staticmethod
+    def _level_file(factor: int) -> str:
+        return os.path.join(
+            CONFIG.INSTANCE_DIR, CONFIG.PYRAMID_FILE.format(factor=factor)
+        )
+
+    @classmethod
+    def _save_level(cls, file: str, sat: np.ndarray, factor: int,
+                    start_row: int = 0):
+        """
+        Save the summed-area table of a raster aggregated by
+        ``factor x factor`` blocks.
+
+        It is the full table sampled at every ``factor``-th row and column,
+        plus the last ones, so ``level[i, j] = sat[min(i * factor, rows),
+        min(j * factor, cols)]`` and blocks cut by the border stay partial.
+
+        :param file: Destination path.
+        :param sat: Full summed-area table.
+        :param factor: Down-sampling factor.
+        :param start_row: First data row that changed since ``file`` was
+                          saved.
+        :return: None
+        """
+        rows, cols = sat.shape[0] - 1, sat.shape[1] - 1
+        idx_r = np.minimum(np.arange(-(-rows // factor) + 1) * factor, rows)
+        idx_c = np.minimum(np.arange(-(-cols // factor) + 1) * factor, cols)
+        level, path, start_row = _open_output(
+            file, sat.dtype, (len(idx_r), len(idx_c)), start_row
+        )
+        for start in range(start_row // factor, len(idx_r),
+                           cls.SAT_CHUNK_ROWS):
+            end = min(start + cls.SAT_CHUNK_ROWS, len(idx_r))
+            level[start:end] = sat[idx_r[start:end]][:, idx_c]
+        _close_output(level, path, file)
+
+    @classmethod
+    def _save_sat(cls, file: str, data_processed: np.ndarray,
+                  start_row: int = 0):
+        """
+        Build the 2D summed-area table from row-wise prefix sums and stream it
+        to an uncompressed ``.npy`` file.
+
+        ``sat[r, c]`` is the sum of all cells in rows ``[0, r)`` and columns
+        ``[0, c)``, so the table has one extra leading row and column of zeros.
+        It is accumulated in float64, ``SAT_CHUNK_ROWS`` rows at a time.
+
+        :param file: Destination path.
+        :param data_processed: Row-wise prefix sums.
+        :param start_row: First data row that changed since ``file`` was
+                          saved; the table is recomputed from there on.
+        :return: None
+        """
+        rows, cols = data_processed.shape
+        sat, path, start_row = _open_output(
+            file, np.float64, (rows + 1, cols + 1), start_row
+        )
+        for start in range(start_row, rows, cls.SAT_CHUNK_ROWS):
+            end = min(start + cls.SAT_CHUNK_ROWS, rows)
+            chunk = np.cumsum(data_processed[start:end], axis=0,
+                              dtype=np.float64)
+            chunk += sat[start, 1:]
+            sat[start + 1:end + 1, 1:] = chunk
+        _close_output(sat, path, file)
 
     def load(self):
+        """
+        Load preprocessed data.
+
+        The ``.npy`` store is memory-mapped read-only, so every server worker
+        shares the same page cache instead of holding its own copy. A legacy
+        compressed ``data.npz`` is converted once on first load. Nothing else
+        is built here, as every worker loads the data at once.
+
+        :return: None
+        """
         logging.info('Loading preprocessed data...')
-        file = os.path.join(CONFIG.INSTANCE_DIR, 'data.npz')
-        self._data_processed = np.load(file)['data']
+        file = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.DATA_FILE)
+        if not os.path.exists(file):
+            legacy = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.LEGACY_DATA_FILE)
+            if not os.path.exists(legacy):
+                raise FileNotFoundError(
+                    f'{file} not found, run with `--preprocess` first.'
+                )
+            logging.warning(f'Converting legacy {legacy} to {file}...')
+            self._data_processed = np.load(legacy)['data']
+            self._save_array(file, self._data_processed)
+            self._save_derived()
+
+        self._data_processed = np.load(file, mmap_mode='r')
+        logging.info(f'Data mapped: {self._data_processed.shape}.')
+
+        file = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.SAT_FILE)
+        if not os.path.exists(file):
+            raise FileNotFoundError(
+                f'{file} not found, run with `--preprocess` to build it.'
+            )
+        self._data_sat = np.load(file, mmap_mode='r')
+        logging.info(f'Summed-area table mapped: {self._data_sat.shape}.')
+
+        self._pyramid = {1: self._data_sat}
+        for factor in self.pyramid_factors():
+            file = self._level_file(factor)
+            if not os.path.exists(file):
+                raise FileNotFoundError(
+                    f'{file} not found, run with `--preprocess` and the same '
+                    '`--pyramid-levels` to build it.'
+                )
+            self._pyramid[factor] = np.load(file, mmap_mode='r')
+        logging.info(f'Pyramid mapped: {sorted(self._pyramid)}.')
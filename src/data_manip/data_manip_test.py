@@ -0,0 +1,178 @@
+from .data_manip import *
+
+import math
+import numpy as np
+import os
+import tempfile
+import unittest
+
+
+class DataManipulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.instance_dir = CONFIG.INSTANCE_DIR
+        self.tmp = tempfile.TemporaryDirectory()
+        CONFIG.INSTANCE_DIR = self.tmp.name
+
+    def tearDown(self):
+        CONFIG.INSTANCE_DIR = self.instance_dir
+        self.tmp.cleanup()
+
+    def test_save_load_mmap(self):
+        data = np.arange(12, dtype=np.float32).reshape(3, 4)
+        dm = DataManipulator()
+        dm._data_processed = data
+        dm.save()
+
+        dm = DataManipulator()
+        dm.load()
+        self.assertIsInstance(dm._data_processed, np.memmap)
+        self.assertFalse(dm._data_processed.flags.writeable)
+        np.testing.assert_array_equal(data, dm._data_processed)
+
+    def test_load_legacy(self):
+        data = np.arange(12, dtype=np.float32).reshape(3, 4)
+        legacy = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.LEGACY_DATA_FILE)
+        np.savez_compressed(legacy, data=data)
+
+        dm = DataManipulator()
+        dm.load()
+        self.assertIsInstance(dm._data_processed, np.memmap)
+        np.testing.assert_array_equal(data, dm._data_processed)
+        self.assertTrue(os.path.exists(
+            os.path.join(CONFIG.INSTANCE_DIR, CONFIG.DATA_FILE)
+        ))
+
+    def write_tiles(self, tile=6):
+        rng = np.random.default_rng(0)
+        tiles = [rng.integers(0, 100, (tile, tile)).astype(np.float32)
+                 for _ in range(8)]
+        tiles[3][1, 2] = -9999
+        dm = DataManipulator()
+        dm.FOLDER = self.tmp.name
+        for file, data in zip(dm.tile_files(), tiles):
+            with open(file, 'w') as f:
+                f.write(f'ncols {tile}\nnrows {tile}\nxllcorner -180\n'
+                        f'yllcorner 0\ncellsize 1\nNODATA_value -9999\n')
+                np.savetxt(f, data, fmt='%g')
+        return dm, tiles
+
+    def test_preprocess(self):
+        dm, tiles = self.write_tiles()
+        dm.preprocess(jobs=2)
+        streamed = np.load(os.path.join(CONFIG.INSTANCE_DIR, CONFIG.DATA_FILE))
+
+        expected = DataManipulator()
+        expected._data_raw = tiles
+        expected.process()
+        np.testing.assert_allclose(expected._data_processed, streamed)
+        self.assertTrue(os.path.exists(
+            os.path.join(CONFIG.INSTANCE_DIR, CONFIG.SAT_FILE)
+        ))
+
+    def test_preprocess_incremental(self):
+        dm, tiles = self.write_tiles()
+        dm.preprocess(jobs=2)
+        manifest = Manifest(
+            os.path.join(CONFIG.INSTANCE_DIR, CONFIG.MANIFEST_FILE)
+        )
+        self.assertEqual(2, len(manifest['bands']))
+
+        # change a tile of the second band and rerun
+        tiles[6][0, 0] += 1000
+        with open(dm.tile_files()[6], 'r') as f:
+            header = ''.join(f.readline() for _ in range(6))
+        with open(dm.tile_files()[6], 'w') as f:
+            f.write(header)
+            np.savetxt(f, tiles[6], fmt='%g')
+        dm = DataManipulator()
+        dm.FOLDER = self.tmp.name
+        with self.assertLogs(level='INFO') as logs:
+            dm.preprocess(jobs=2)
+        self.assertIn('INFO:root:7 unchanged tiles reused.', logs.output)
+        self.assertNotIn('INFO:root:Assembling rows 0-6...', logs.output)
+        self.assertIn('INFO:root:Assembling rows 6-12...', logs.output)
+
+        expected = DataManipulator()
+        expected._data_raw = tiles
+        expected.process()
+        expected._save_sat(os.path.join(self.tmp.name, 'expected.npy'),
+                           expected._data_processed)
+        dm = DataManipulator()
+        dm.load()
+        np.testing.assert_allclose(expected._data_processed,
+                                   dm._data_processed)
+        np.testing.assert_allclose(
+            np.load(os.path.join(self.tmp.name, 'expected.npy')), dm._data_sat
+        )
+        self.assertEqual(8, len(os.listdir(
+            os.path.join(CONFIG.INSTANCE_DIR, CONFIG.TILE_DIR)
+        )))
+
+    def test_process_float64(self):
+        rng = np.random.default_rng(0)
+        tiles = [rng.random((4, 4), dtype=np.float32) * 1e4 for _ in range(8)]
+        raw = np.block([tiles[:4], tiles[4:]]).astype(np.float64)
+
+        CONFIG.PREFIX_DTYPE, dtype = 'float64', CONFIG.PREFIX_DTYPE
+        try:
+            dm = DataManipulator()
+            dm._data_raw = tiles
+            dm.process()
+        finally:
+            CONFIG.PREFIX_DTYPE = dtype
+        self.assertEqual(np.float64, dm._data_processed.dtype)
+        np.testing.assert_array_equal(np.cumsum(raw, axis=1),
+                                      dm._data_processed)
+        self.assertEqual(math.fsum(raw.ravel()), dm.total())
+
+    def test_iter_asc_chunks(self):
+        dm, tiles = self.write_tiles()
+        chunks = list(iter_asc_chunks(dm.tile_files()[3], 4))
+        self.assertEqual([0, 4], [start for start, _ in chunks])
+        data = np.concatenate([chunk for _, chunk in chunks])
+        np.testing.assert_array_equal(np.where(tiles[3] < 0, 0, tiles[3]),
+                                      data)
+
+        # parsed as the prefix sums are stored
+        CONFIG.PREFIX_DTYPE, dtype = 'float64', CONFIG.PREFIX_DTYPE
+        try:
+            chunks = list(iter_asc_chunks(dm.tile_files()[3], 4))
+        finally:
+            CONFIG.PREFIX_DTYPE = dtype
+        self.assertEqual(np.float64, chunks[0][1].dtype)
+
+    def test_load_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            DataManipulator().load()
+
+    def test_missing_sat(self):
+        dm, tiles = self.write_tiles()
+        dm.preprocess(jobs=2)
+        sat_file = os.path.join(CONFIG.INSTANCE_DIR, CONFIG.SAT_FILE)
+        sat = np.load(sat_file)
+        os.remove(sat_file)
+        with self.assertRaises(FileNotFoundError):
+            DataManipulator().load()
+
+        dm.preprocess(jobs=2)
+        dm = DataManipulator()
+        dm.load()
+        np.testing.assert_array_equal(sat, dm._data_sat)
+
+    def test_missing_level(self):
+        dm, tiles = self.write_tiles()
+        dm.preprocess(jobs=2)
+        level_file = dm._level_file(4)
+        level = np.load(level_file)
+        os.remove(level_file)
+        with self.assertRaises(FileNotFoundError):
+            DataManipulator().load()
+
+        dm.preprocess(jobs=2)
+        dm = DataManipulator()
+        dm.load()
+        np.testing.assert_array_equal(level, dm._pyramid[4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manifest of the incremental preprocessing pipeline.
+"""
+
+from typing import Any, Dict
+
+import hashlib
+import json
+import os
+
+
+def file_sha256(file: str, block_size: int = 1 << 20) -> str:
+    """
+    Hash a file without reading it into memory at once.
+
+    :param file: Path of the file.
+    :param block_size: Bytes read per step.
+    :return: Hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Records which inputs every preprocessed artifact was built from, so that
+    an interrupted or repeated run only redoes what is missing or stale.
+
+    Every update is written to disk atomically before the work it describes
+    is trusted, e.g. a band is removed from ``bands`` before it is rewritten.
+    """
+
+    VERSION = 1
+
+    def __init__(self, file: str):
+        self.file = file
+        self.data: Dict[str, Any] = {}
+        if os.path.exists(file):
+            with open(file) as f:
+                self.data = json.load(f)
+        if self.data.get('version') != self.VERSION:
+            self.data = {'version': self.VERSION}
+
+    def __getitem__(self, item):
+        return self.data[item]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.save()
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def save(self):
+        tmp = f'{self.file}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.file)
@@ -3,6 +3,7 @@
 from config import Cli, CONFIG
 import util
 
+import json
 import logging
 
 
@@ -21,14 +22,36 @@ def preprocess_main():
 
     from data_manip import DataManipulator
     dm = DataManipulator()
-    dm.load_raw()
-    dm.process()
-    dm.save()
+    dm.preprocess(CONFIG.PREPROCESS_JOBS)
 
     end = util.get_cur_time_ms()
     logging.info(f'Data preprocessed in {(end - start) / 1000} s.')
 
 
+def bench_main(addr, port, args):
+    from bench import format_report, load_requests, random_requests, run_load
+    from client import PopulationClient
+
+    if args.replay:
+        requests = load_requests(args.replay)
+        logging.info(f'Replaying {len(requests)} requests from {args.replay}.')
+    else:
+        requests = random_requests(args.requests)
+        logging.info(f'Sending {len(requests)} random polygons.')
+
+    client = PopulationClient(f'{addr}:{port}', args.concurrency)
+    try:
+        report = client.call(run_load(client, requests, args.concurrency,
+                                      args.rate))
+    finally:
+        client.close()
+
+    logging.info(f'Load test finished:\n{format_report(report)}')
+    if args.bench_output:
+        with open(args.bench_output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
 def require_arg(arg, name, default):
     if arg is None:
         logging.info(f'No `{name}` specified, default to {default}')
@@ -44,16 +67,24 @@ def innocent_arg(arg, name):
 def main():
     arg_parser = Cli()
     args = arg_parser.parse_args()
+    CONFIG.PYRAMID_LEVELS = args.pyramid_levels
     init_file()
-    util.init_logging(args.log, args.log_file)
-
-    if not any((args.preprocess, args.client, args.server)):
-        logging.error('No action (client, server, preprocess) specified.')
+    CONFIG.LOG_QUEUE = args.log_queue
+    CONFIG.LOG_PAYLOAD_LIMIT = args.log_payload_limit
+    CONFIG.LOG_SAMPLE_RATE = args.log_sample_rate
+    util.init_logging(args.log, args.log_file, CONFIG.LOG_QUEUE)
+
+    if not any((args.preprocess, args.client, args.server, args.bench)):
+        logging.error(
+            'No action (client, server, preprocess, bench) specified.'
+        )
         arg_parser.print_help()
 
     elif args.preprocess:
         innocent_arg(args.addr, 'addr')
         innocent_arg(args.port, 'port')
+        CONFIG.PREPROCESS_JOBS = args.jobs
+        CONFIG.PREFIX_DTYPE = args.precision
         preprocess_main()
 
     elif args.client:
@@ -64,9 +95,24 @@ def main():
         client = Client(addr, port)
         client.run()
 
+    elif args.bench:
+        addr = require_arg(args.addr, 'addr', CONFIG.DEFAULT_ADDR)
+        port = require_arg(args.port, 'port', CONFIG.DEFAULT_PORT)
+        bench_main(addr, port, args)
+
     elif args.server:
         innocent_arg(args.addr, 'addr')
         port = require_arg(args.port, 'port', CONFIG.DEFAULT_PORT)
+        CONFIG.QUERY_ENGINE = args.engine
+        CONFIG.EXECUTOR = args.executor
+        CONFIG.POOL_SIZE = args.pool_size
+        CONFIG.CACHE_SIZE = args.cache_size
+        CONFIG.CACHE_TTL = args.cache_ttl
+        CONFIG.BATCH_CHUNK = args.batch_chunk
+        CONFIG.TILE_CACHE_SIZE = args.tile_cache_size
+        CONFIG.TILE_DISK_CACHE_SIZE = args.tile_disk_cache_size
+        CONFIG.ADMIN_ENDPOINTS = args.admin
+        CONFIG.PROFILE_INTERVAL = args.profile_interval
 
         from server import Server
         server = Server(port)
@@ -1,3 +1,4 @@
 # -*- coding: utf-8 -*-
 
 from .projection import *
+from .polygon import *
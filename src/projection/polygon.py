@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+Polygon container.
+
+Stores the vertices of a polygon in one contiguous NumPy array instead of a
+list of Point2D objects.
+"""
+
+from .projection import Point2D
+
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+
+class Polygon:
+    """
+    Read-only polygon whose vertices are the ``(x, y)`` rows of an ``(n, 2)``
+    array: int64 for grid points, float64 otherwise.
+
+    It also behaves like a sequence of Point2D objects, so code written for
+    ``List[Point2D]`` keeps working, but the geometry in ``server.algo``
+    reads `vertices` or `coords` directly and creates no per-vertex objects.
+    """
+    __slots__ = ('vertices', '_coords')
+
+    def __init__(self, vertices):
+        """
+        :param vertices: Anything convertible to an ``(n, 2)`` array.
+        """
+        vertices = np.asarray(vertices)
+        if vertices.ndim != 2 or vertices.shape[1] != 2:
+            raise ValueError('vertices must be of shape (n, 2)')
+        dtype = np.int64 \
+            if np.issubdtype(vertices.dtype, np.integer) else np.float64
+        self.vertices = np.ascontiguousarray(vertices, dtype=dtype)
+        self.vertices.flags.writeable = False
+        self._coords = None
+
+    @classmethod
+    def from_points(cls, points: Iterable[Point2D]):
+        """
+        Create a Polygon object from Point2D objects.
+
+        :param points: Vertices.
+        :return: Polygon object.
+        """
+        return cls([(p.x, p.y) for p in points])
+
+    @property
+    def coords(self) -> List[Tuple]:
+        """
+        Vertices as a cached list of ``(x, y)`` tuples of Python numbers,
+        the fastest form for scalar loops.
+        """
+        if self._coords is None:
+            self._coords = list(map(tuple, self.vertices.tolist()))
+        return self._coords
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.vertices[:, 0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.vertices[:, 1]
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def __getitem__(self, index: int) -> Point2D:
+        x, y = self.coords[index]
+        return Point2D(x, y)
+
+    def __iter__(self):
+        return (Point2D(x, y) for x, y in self.coords)
+
+    def __eq__(self, other):
+        if not isinstance(other, Polygon):
+            return NotImplemented
+        return np.array_equal(self.vertices, other.vertices)
+
+    def __getstate__(self):
+        return self.vertices
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def __repr__(self):
+        return f'Polygon({self.coords})'
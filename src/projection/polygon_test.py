@@ -0,0 +1,40 @@
+from .polygon import *
+
+import pickle
+import unittest
+
+
+class PolygonTest(unittest.TestCase):
+    def test_vertices(self):
+        p = Polygon([[0, 1], [2, 3], [4, 5]])
+        self.assertEqual(np.int64, p.vertices.dtype)
+        self.assertTrue(p.vertices.flags.c_contiguous)
+        self.assertFalse(p.vertices.flags.writeable)
+        self.assertEqual([0, 2, 4], p.x.tolist())
+        self.assertEqual([1, 3, 5], p.y.tolist())
+
+        p = Polygon([[0, 1.5], [2, 3]])
+        self.assertEqual(np.float64, p.vertices.dtype)
+
+        with self.assertRaises(ValueError):
+            Polygon([0, 1, 2])
+
+    def test_sequence(self):
+        points = [Point2D(0, 1), Point2D(2, 3), Point2D(4, 5)]
+        p = Polygon.from_points(points)
+        self.assertEqual(3, len(p))
+        self.assertEqual(Point2D(2, 3), p[1])
+        self.assertEqual(points, list(p))
+        self.assertEqual([(0, 1), (2, 3), (4, 5)], p.coords)
+
+    def test_pickle(self):
+        p = Polygon([[0, 1], [2, 3], [4, 5]])
+        self.assertEqual(p, pickle.loads(pickle.dumps(p)))
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            Point2D(0, 1).z = 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ Using Mollweide projection to project the world map.
 import logging
 from dataclasses import dataclass
 from math import pi, sin, cos, asin, sqrt
+from typing import List, Tuple
 
 import numpy as np
 
@@ -21,6 +22,8 @@ class Point2D:
     """
     Point in 2D space.
     """
+    __slots__ = ('x', 'y')
+
     x: int  # range: [0, 10800 * 2)
     y: int  # range: [0, 10800 * 4)
 
@@ -36,7 +39,7 @@ class Point2D:
         :param y: y portion, range: [-1, 1].
         :return: Point2D object.
         """
-        logging.debug(f'Point2D from portion x: {x}, y: {y}.')
+        logging.debug('Point2D from portion x: %s, y: %s.', x, y)
         if x < -2 or x > 2:
             raise ValueError('x must be in [-2, 2]')
         if y < -1 or y > 1:
@@ -62,6 +65,8 @@ class Point3D:
     """
     Point in 3D space. Latitude and longitude are in radians.
     """
+    __slots__ = ('longitude', 'latitude')
+
     longitude: float  # range: [-pi, pi]
     latitude: float  # range: [-pi / 2, pi / 2]
 
@@ -79,7 +84,8 @@ class Point3D:
         :return: Point3D object.
         """
         logging.debug(
-            f'Point3D from rad longitude: {longitude}, latitude: {latitude}.'
+            'Point3D from rad longitude: %s, latitude: %s.',
+            longitude, latitude
         )
         if longitude < -pi or longitude > pi:
             raise ValueError('longitude must be in [-pi, pi]')
@@ -98,7 +104,8 @@ class Point3D:
         :return: Point3D object.
         """
         logging.debug(
-            f'Point3D from deg longitude: {longitude}, latitude: {latitude}.'
+            'Point3D from deg longitude: %s, latitude: %s.',
+            longitude, latitude
         )
         # if longitude < -180 or longitude > 180:
         #     raise ValueError('longitude must be in [-180, 180]')
@@ -179,3 +186,100 @@ def inv_project(point: Point2D) -> Point3D:
     lon = pi * x / (2 * cos(theta))
     lat = asin((2 * theta + sin(2 * theta)) / pi)
     return Point3D.from_rad(lon, lat)
+
+
+def portion_to_grid(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    Array version of `Point2D.from_portion`.
+
+    :param x: x portions, range: [-2, 2].
+    :param y: y portions, range: [-1, 1].
+    :return: ``(rows, cols)`` as int64 arrays, i.e. ``Point2D.x`` and
+             ``Point2D.y`` of every point.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if np.any((x < -2) | (x > 2)):
+        raise ValueError('x must be in [-2, 2]')
+    if np.any((y < -1) | (y > 1)):
+        raise ValueError('y must be in [-1, 1]')
+
+    rows = ((-y + 1) * CONSTANT).astype(np.int64)
+    cols = ((x + 2) * CONSTANT).astype(np.int64)
+    np.minimum(rows, VERTICAL - 1, out=rows)
+    np.minimum(cols, HORIZONTAL - 1, out=cols)
+    return rows, cols
+
+
+def project_array(longitude: np.ndarray,
+                  latitude: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    Array version of `project`.
+
+    :param longitude: Longitudes in radians.
+    :param latitude: Latitudes in radians.
+    :return: ``(rows, cols)`` on the world map.
+    """
+    return portion_to_grid(np.asarray(longitude) / pi * 2,
+                           np.asarray(latitude) / pi * 2)
+
+
+def project_mollweide_array(longitude: np.ndarray,
+                            latitude: np.ndarray,
+                            iterations: int = 10) -> Tuple[np.ndarray, ...]:
+    """
+    Array version of `project_`, solving 2theta + sin(2theta) = pi * sin(phi)
+    for all points at once with Newton's method.
+
+    :param longitude: Longitudes in radians.
+    :param latitude: Latitudes in radians.
+    :param iterations: Number of Newton steps.
+    :return: ``(rows, cols)`` on the world map.
+    """
+    longitude = np.asarray(longitude, dtype=np.float64)
+    latitude = np.asarray(latitude, dtype=np.float64)
+    pole = np.abs(latitude) == pi / 2
+
+    rhs = pi * np.sin(latitude)
+    theta = latitude.copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(iterations):
+            tmp = 2 * theta
+            theta -= (tmp + np.sin(tmp) - rhs) / (2 + 2 * np.cos(tmp))
+    theta = np.where(pole, latitude, theta)
+
+    x = np.where(pole, 0., 2 / pi * longitude * np.cos(theta))
+    y = np.sin(theta)
+    return portion_to_grid(x, y)
+
+
+def inv_project_array(rows: np.ndarray,
+                      cols: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    Array version of `inv_project`.
+
+    :param rows: ``Point2D.x`` of the points.
+    :param cols: ``Point2D.y`` of the points.
+    :return: ``(longitude, latitude)`` in radians.
+    """
+    x = np.asarray(cols) / CONSTANT - 2
+    y = np.asarray(rows) / CONSTANT - 1
+
+    theta = np.arcsin(y)
+    lon = pi * x / (2 * np.cos(theta))
+    lat = np.arcsin((2 * theta + np.sin(2 * theta)) / pi)
+    if np.any((lon < -pi) | (lon > pi)):
+        raise ValueError('longitude must be in [-pi, pi]')
+    return lon, lat
+
+
+def project_points(points: List[Point3D]) -> List[Point2D]:
+    """
+    Project many points at once with `project_array`.
+
+    :param points: List of Point3D objects.
+    :return: List of Point2D objects.
+    """
+    rows, cols = project_array([p.longitude for p in points],
+                               [p.latitude for p in points])
+    return [Point2D(x, y) for x, y in zip(rows.tolist(), cols.tolist())]
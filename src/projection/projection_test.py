@@ -55,6 +55,33 @@ class ProjectionTest(unittest.TestCase):
             # uncomment the following line to see the result.
             print(f'({p.x}, {p.y})')
 
+    def test_project_array(self):
+        lon = np.deg2rad(np.arange(-180, 181, 15, dtype=np.float64))
+        lat = np.deg2rad(np.linspace(-90, 90, len(lon)))
+        for vectorized, scalar in ((project_array, project),
+                                   (project_mollweide_array, project_)):
+            rows, cols = vectorized(lon, lat)
+            for i in range(len(lon)):
+                p = scalar(Point3D.from_rad(lon[i], lat[i]))
+                self.assertEqual((p.x, p.y), (rows[i], cols[i]))
+
+    def test_portion_to_grid(self):
+        with self.assertRaises(ValueError):
+            portion_to_grid([0, 3], [0, 0])
+        rows, cols = portion_to_grid([0, 1, -1], [0, 1, -1])
+        self.assertEqual([VERTICAL / 2, 0, VERTICAL - 1], rows.tolist())
+        self.assertEqual([HORIZONTAL / 2, HORIZONTAL * .75,
+                          HORIZONTAL * .25], cols.tolist())
+
+    def test_inv_project_array(self):
+        rows = np.array([10800, 5000, 15000])
+        cols = np.array([21600, 20000, 25000])
+        lon, lat = inv_project_array(rows, cols)
+        for i in range(len(rows)):
+            p = inv_project(Point2D(rows[i], cols[i]))
+            self.assertAlmostEqual(p.longitude, lon[i])
+            self.assertAlmostEqual(p.latitude, lat[i])
+
 
 if __name__ == '__main__':
     unittest.main()
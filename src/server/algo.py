@@ -1,9 +1,15 @@
 import logging
 
+from .metrics import stage
 from data_manip import DataManipulator
-from projection import Point2D
+from projection import Point2D, Polygon
 
-from typing import List
+from typing import List, Tuple, Union
+
+import numpy as np
+
+
+Convex = Union[List[Point2D], Polygon]
 
 
 class MinMax:
@@ -47,24 +53,49 @@ def cross(lhs: Point2D, rhs: Point2D) -> float:
     return lhs.x * rhs.y - lhs.y * rhs.x
 
 
-def calc_convex(p: List[Point2D]) -> List[Point2D]:
+def _cross(o: Tuple, a: Tuple, b: Tuple) -> float:
+    """
+    Cross product of ``a - o`` and ``b - o``, on coordinate tuples.
+    """
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def _coords(polygon: Convex) -> List[Tuple]:
+    if isinstance(polygon, Polygon):
+        return polygon.coords
+    return [(p.x, p.y) for p in polygon]
+
+
+def as_vertices(polygon: Convex) -> np.ndarray:
+    """
+    Vertices of a polygon as an ``(n, 2)`` array, without copying a Polygon.
+
+    :param polygon: Polygon object or list of points.
+    :return: Array of ``(x, y)`` rows.
+    """
+    if isinstance(polygon, Polygon):
+        return polygon.vertices
+    return np.array([(p.x, p.y) for p in polygon], dtype=np.int64)
+
+
+def calc_convex(p: Convex) -> Convex:
     """
     Calculate the convex hull of a list of points.
 
-    :param p: List of points.
+    :param p: List of points, or a Polygon object.
     :return: List of points consisted of the convex hull. In counter-clockwise
-             order.
+             order. A Polygon object if ``p`` is one.
     """
-    p.sort(key=lambda p: (p.x, p.y))
-    used = [False] * len(p)
+    p_ = sorted(_coords(p))
+    used = [False] * len(p_)
 
     stack = [0]
     # used[0] = True
 
     # 求下凸壳
-    for i in range(1, len(p)):
-        while len(stack) > 1 and cross(
-                p[stack[-1]] - p[stack[-2]], p[i] - p[stack[-1]]
+    for i in range(1, len(p_)):
+        while len(stack) > 1 and _cross(
+                p_[stack[-2]], p_[stack[-1]], p_[i]
         ) <= 0:
             used[stack.pop()] = False
         stack.append(i)
@@ -72,20 +103,22 @@ def calc_convex(p: List[Point2D]) -> List[Point2D]:
 
     base = len(stack)
     # 求上凸壳
-    for i in range(len(p) - 2, -1, -1):
+    for i in range(len(p_) - 2, -1, -1):
         if used[i]:
             continue
-        while len(stack) > base and cross(
-                p[stack[-1]] - p[stack[-2]], p[i] - p[stack[-1]]
+        while len(stack) > base and _cross(
+                p_[stack[-2]], p_[stack[-1]], p_[i]
         ) <= 0:
             used[stack.pop()] = False
         stack.append(i)
         used[i] = True
 
-    return [p[i] for i in stack]
+    if isinstance(p, Polygon):
+        return Polygon([p_[i] for i in stack])
+    return [Point2D(*p_[i]) for i in stack]
 
 
-def point_in_convex_linear(point: Point2D, convex: List[Point2D]) -> bool:
+def point_in_convex_linear(point: Point2D, convex: Convex) -> bool:
     """
     Check if a point is in a convex.
 
@@ -93,30 +126,90 @@ def point_in_convex_linear(point: Point2D, convex: List[Point2D]) -> bool:
     :param convex: Convex to check, in counter-clockwise order.
     :return: True if the point is in the convex, False otherwise.
     """
-    for i in range(len(convex) - 1):
-        if cross(convex[i] - point, convex[(i + 1) % len(convex)] - point) < 0:
+    pt = (point.x, point.y)
+    c = _coords(convex)
+    for i in range(len(c) - 1):
+        if _cross(pt, c[i], c[(i + 1) % len(c)]) < 0:
             return False
     return True
 
 
-def point_in_convex(point: Point2D, convex: List[Point2D]) -> bool:
+def point_in_convex(point: Point2D, convex: Convex) -> bool:
     """
     Check if a point is in a convex.
 
     :param point: Point to check.
-    :param convex: Convex to check, in counter-clockwise order.
+    :param convex: Convex to check, in counter-clockwise order. O(log n) for a
+                   Polygon object, whose coordinates are cached.
     :return: True if the point is in the convex, False otherwise.
     """
+    pt = (point.x, point.y)
+    c = _coords(convex)
+    n = len(c) - 1 if c[-1] == c[0] else len(c)
+    if n < 3:
+        return point_in_convex_linear(point, convex)
+
+    # outside the fan of triangles around c[0]
+    if _cross(c[0], c[1], pt) < 0 or _cross(c[0], c[n - 1], pt) > 0:
+        return False
+
     lb = 0
-    rb = len(convex) - 1
+    rb = n - 1
     while rb - lb > 1:
         mid = (lb + rb) // 2
-        if cross(convex[mid] - convex[0], point - convex[0]) >= 0:
+        if _cross(c[0], c[mid], pt) >= 0:
             lb = mid
         else:
             rb = mid
 
-    return cross(convex[lb] - point, convex[rb] - point) >= 0
+    return _cross(pt, c[lb], c[rb]) >= 0
+
+
+def points_in_convex(points, convex: Convex) -> np.ndarray:
+    """
+    Check which of many points are in a convex, in O(m log n).
+
+    The convex is split into a fan of triangles around its first vertex. The
+    triangle of every point is found with one `np.searchsorted` over the
+    angles of the fan, then checked with exact cross products.
+
+    :param points: ``(m, 2)`` array of ``(x, y)`` rows, a Polygon object or a
+                   list of points.
+    :param convex: Convex returned by `calc_convex`, i.e. counter-clockwise
+                   and starting from its smallest ``(x, y)``.
+    :return: Boolean mask, True for the points in the convex.
+    """
+    if not isinstance(points, np.ndarray):
+        points = as_vertices(points)
+    v = as_vertices(convex)
+    if len(v) > 1 and np.array_equal(v[0], v[-1]):
+        v = v[:-1]
+
+    if len(v) < 3:
+        # degenerate convex: a point or a segment
+        closed = np.concatenate((v, v[:1]))
+        edge = closed[1:] - closed[:-1]
+        rel = points[:, None, :] - closed[:-1]
+        on_line = np.all(edge[:, 0] * rel[..., 1] == edge[:, 1] * rel[..., 0],
+                         axis=-1)
+        return on_line & np.all((points >= v.min(axis=0))
+                                & (points <= v.max(axis=0)), axis=-1)
+
+    o = v[0]
+    rel = points - o
+    fan = v[1:] - o
+    angles = np.arctan2(fan[:, 1], fan[:, 0])
+    i = np.searchsorted(angles, np.arctan2(rel[:, 1], rel[:, 0]),
+                        side='right')
+    i = np.clip(i, 1, len(v) - 2)
+
+    a = v[i]
+    b = v[i + 1]
+    return ((a[:, 0] - o[0]) * rel[:, 1] - (a[:, 1] - o[1]) * rel[:, 0] >= 0) \
+        & ((b[:, 0] - a[:, 0]) * (points[:, 1] - a[:, 1])
+           - (b[:, 1] - a[:, 1]) * (points[:, 0] - a[:, 0]) >= 0) \
+        & ((o[0] - b[:, 0]) * (points[:, 1] - b[:, 1])
+           - (o[1] - b[:, 1]) * (points[:, 0] - b[:, 0]) >= 0)
 
 
 class DataAccessor(DataManipulator):
@@ -125,7 +218,7 @@ class DataAccessor(DataManipulator):
         self.load()
 
     def query_all_sum(self):
-        return self._data_processed[21509, 43109]
+        return self._data_sat[-1, -1]
 
     def query(self, row, starting_col, ending_col):
         if row >= 21600:
@@ -140,6 +233,134 @@ class DataAccessor(DataManipulator):
         )
         return ret
 
+    def query_spans(self, rows: np.ndarray, lo: np.ndarray, hi: np.ndarray):
+        """
+        Sum of many row spans with one gather, span ``i`` being the columns
+        ``[lo[i], hi[i])`` of row ``rows[i]``. Empty spans are allowed.
+        """
+        data = self._data_processed
+        keep = lo < hi
+        rows, lo, hi = rows[keep], lo[keep], hi[keep]
+        cols = np.concatenate((hi - 1, lo - 1))
+        ends, starts = data[np.tile(rows, 2), cols] \
+            .astype(np.float64).reshape(2, -1)
+        starts[lo == 0] = 0
+        return float(np.sum(ends - starts))
+
+    def query_rect(self, start_row, end_row, start_col, end_col):
+        """
+        Sum of the rectangle ``[start_row, end_row) x [start_col, end_col)``
+        in O(1), using the summed-area table.
+        """
+        sat = self._data_sat
+        return (sat[end_row, end_col] - sat[start_row, end_col]
+                - sat[end_row, start_col] + sat[start_row, start_col])
+
+    def coarsest_level(self, width: int):
+        """
+        Pick the coarsest pyramid level whose blocks divide ``width`` and
+        are at most a quarter of it, so that aligning a grid to the blocks
+        moves it by less than a quarter of a cell.
+
+        :param width: Side length of the cells to sum.
+        :return: ``(factor, table)``, where ``table[i, j]`` is the full
+                 summed-area table at ``(i * factor, j * factor)``, clipped to
+                 the raster.
+        """
+        factor = max(f for f in self._pyramid
+                     if f == 1 or (width % f == 0 and 4 * f <= width))
+        return factor, self._pyramid[factor]
+
+
+def convex_row_spans(
+        convex: Convex, shape: Tuple[int, int]
+) -> Tuple[int, np.ndarray, np.ndarray]:
+    """
+    Rasterize the boundary of a convex into one column span per row.
+
+    :param convex: Convex, in counter-clockwise order, first point repeated at
+                   the end.
+    :param shape: Shape of the raster, used for clipping.
+    :return: ``(first_row, lo, hi)``, where row ``first_row + i`` covers the
+             columns ``[lo[i], hi[i]]``, both ends inclusive. Rows outside the
+             raster are dropped.
+    """
+    vertices = as_vertices(convex).astype(np.int64, copy=False)
+    x1, y1 = vertices[:-1, 0], vertices[:-1, 1]
+    x2, y2 = vertices[1:, 0], vertices[1:, 1]
+    dx = x2 - x1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.where(dx != 0, (y2 - y1) / dx, 0.)
+    b = y1 - k * x1
+
+    # every edge visits each row between its end points, both inclusive
+    counts = np.abs(dx) + 1
+    edge = np.repeat(np.arange(len(dx)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                 counts)
+    xs = np.minimum(x1, x2)[edge] + offset
+    ys = (k[edge] * xs + b[edge]).astype(np.int64)
+
+    # an edge lying on a single row also reaches its other end point
+    flat = np.flatnonzero(dx == 0)
+    xs = np.concatenate((xs, x2[flat]))
+    ys = np.concatenate((ys, y2[flat]))
+
+    order = np.argsort(xs, kind='stable')
+    xs = xs[order]
+    ys = ys[order]
+    starts = np.flatnonzero(np.diff(xs, prepend=xs[0] - 1))
+    first_row = int(xs[0])
+    lo = np.minimum.reduceat(ys, starts)
+    hi = np.maximum.reduceat(ys, starts)
+
+    rows, cols = shape
+    if first_row < 0:
+        lo = lo[-first_row:]
+        hi = hi[-first_row:]
+        first_row = 0
+    lo = lo[:max(0, rows - first_row)]
+    hi = hi[:max(0, rows - first_row)]
+    np.clip(lo, 0, cols - 1, out=lo)
+    np.clip(hi, 0, cols - 1, out=hi)
+    return first_row, lo, hi
+
+
+def _sum_column_runs(sat: np.ndarray, first_row: int, col: np.ndarray):
+    """
+    Sum of all cells left of a staircase boundary: row ``first_row + i``
+    contributes the columns ``[0, col[i])``.
+
+    Consecutive rows sharing the same boundary column form a rectangle that
+    costs two table lookups, so an axis-aligned edge is O(1) and a slanted one
+    is proportional to the number of steps it makes.
+    """
+    starts = np.flatnonzero(np.diff(col, prepend=-1))
+    ends = np.append(starts[1:], len(col))
+    cols = col[starts]
+    return np.sum(sat[first_row + ends, cols] - sat[first_row + starts, cols])
+
+
+def calc_whole_convex_sat(convex, data_accessor):
+    """
+    Sum the population inside a convex by edge-based integration over the
+    summed-area table.
+
+    :param convex: Convex, in counter-clockwise order.
+    :param data_accessor: DataAccessor object.
+    :return: Population inside the convex.
+    """
+    sat = data_accessor._data_sat
+    with stage('rasterize'):
+        first_row, lo, hi = convex_row_spans(
+            convex, data_accessor._data_processed.shape
+        )
+    if len(lo) == 0:
+        return 0.
+    with stage('lookup'):
+        return float(_sum_column_runs(sat, first_row, hi + 1)
+                     - _sum_column_runs(sat, first_row, lo))
+
 
 def calc_whole_convex(convex, data_accessor):
     intersections = MinMaxDict()
@@ -169,3 +390,368 @@ def calc_whole_convex(convex, data_accessor):
         min_, max_ = intersections.get(x)
         ans += data_accessor.query(x, min_, max_)
     return ans
+
+
+def calc_whole_convex_vectorized(convex, data_accessor):
+    """
+    Sum the population inside a convex, gathering every row sum from the
+    row-wise prefix sums with a single fancy-indexed lookup.
+
+    :param convex: Convex, in counter-clockwise order.
+    :param data_accessor: DataAccessor object.
+    :return: Population inside the convex.
+    """
+    data = data_accessor._data_processed
+    with stage('rasterize'):
+        first_row, lo, hi = convex_row_spans(convex, data.shape)
+    with stage('lookup'):
+        rows = np.arange(first_row, first_row + len(lo))
+        ends, starts = data[np.tile(rows, 2), np.concatenate((hi, lo - 1))] \
+            .astype(np.float64).reshape(2, -1)
+        starts[lo == 0] = 0
+        return float(np.sum(ends - starts))
+
+
+def _edge_pieces(vertices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cut every edge of a closed polygon where it crosses a row or column
+    boundary, so that each piece lies within a single cell.
+
+    :param vertices: ``(n, 2)`` float array, not closed.
+    :return: ``(starts, ends)``, ``(m, 2)`` arrays of the pieces, m being
+             proportional to the perimeter in cells.
+    """
+    starts = vertices
+    deltas = np.roll(vertices, -1, axis=0) - starts
+    edges, params = [np.arange(len(starts))] * 2, [np.zeros(len(starts)),
+                                                    np.ones(len(starts))]
+    for axis in (0, 1):
+        a0, d = starts[:, axis], deltas[:, axis]
+        # integers strictly between the end points of every edge
+        first = np.floor(np.minimum(a0, a0 + d)) + 1
+        counts = np.maximum(
+            np.ceil(np.maximum(a0, a0 + d)) - first, 0
+        ).astype(np.int64)
+        edge = np.repeat(np.arange(len(counts)), counts)
+        k = first[edge] + np.arange(counts.sum()) \
+            - np.repeat(np.cumsum(counts) - counts, counts)
+        edges.append(edge)
+        params.append((k - a0[edge]) / d[edge])
+
+    edge = np.concatenate(edges)
+    t = np.concatenate(params)
+    order = np.lexsort((t, edge))
+    edge, t = edge[order], t[order]
+    same = edge[1:] == edge[:-1]
+    edge = edge[1:][same]
+    return (starts[edge] + t[:-1][same, None] * deltas[edge],
+            starts[edge] + t[1:][same, None] * deltas[edge])
+
+
+def calc_whole_convex_exact(convex, data_accessor):
+    """
+    Sum the population inside a convex, weighting every cell by the exact
+    fraction of it that the convex covers.
+
+    Vertices are points of the continuous raster plane, where cell
+    ``(r, c)`` is ``[r, r + 1) x [c, c + 1)``, so integral vertices are cell
+    corners. Like an anti-aliasing rasterizer, every edge piece within a cell
+    adds the area it bounds to its cell, and its height to the cells right of
+    it, so the coverage of a cell is the running sum of these along its row.
+    The coverage only changes at cells crossed by an edge, and the runs of
+    equal coverage between them are summed with the row-wise prefix sums, so
+    the cost is proportional to the perimeter.
+
+    :param convex: Convex, in counter-clockwise order.
+    :param data_accessor: DataAccessor object.
+    :return: Population inside the convex.
+    """
+    data = data_accessor._data_processed
+    rows, cols = data.shape
+    vertices = np.array(_coords(convex), dtype=np.float64)
+    if len(vertices) > 1 and (vertices[0] == vertices[-1]).all():
+        vertices = vertices[:-1]
+    if len(vertices) < 3:
+        return 0.
+
+    with stage('rasterize'):
+        start, end = _edge_pieces(vertices)
+        height = end[:, 0] - start[:, 0]
+        mid = (start + end) / 2
+        row = np.floor(mid[:, 0]).astype(np.int64)
+        col = np.floor(mid[:, 1]).astype(np.int64)
+        area = height * (col + 1 - mid[:, 1])
+
+        # cells left of the raster only shift the running sum of column 0
+        row = np.tile(row, 2)
+        col = np.maximum(np.concatenate((col, col + 1)), 0)
+        value = np.concatenate((area, height - area))
+        keep = (row >= 0) & (row < rows) & (col < cols) & (value != 0)
+        keys, inverse = np.unique(row[keep] * cols + col[keep],
+                                  return_inverse=True)
+        value = np.bincount(inverse, value[keep], minlength=len(keys))
+        row, col = keys // cols, keys % cols
+
+        # coverage from each key to the next one of the same row, or to the
+        # end of the raster, where it is 0 unless the convex is cut there
+        coverage = np.cumsum(value)
+        first = np.flatnonzero(np.diff(row, prepend=-1))
+        coverage -= np.repeat(np.append(0., coverage)[first],
+                              np.diff(np.append(first, len(row))))
+        coverage[np.abs(coverage) < 1e-12] = 0
+        stop = np.append(col[1:], cols)
+        stop[np.append(row[1:] != row[:-1], True)] = cols
+
+    with stage('lookup'):
+        run = coverage != 0
+        row, col, stop, coverage = row[run], col[run], stop[run], \
+            coverage[run]
+        sums = data[row, stop - 1].astype(np.float64)
+        before = col > 0
+        sums[before] -= data[row[before], col[before] - 1]
+        # the orientation of the ring sets the sign of the coverage
+        u, v = vertices[:, 0], vertices[:, 1]
+        sign = 1 if np.sum(u * np.roll(v, -1) - np.roll(u, -1) * v) >= 0 \
+            else -1
+        return float(sign * np.sum(coverage * sums))
+
+
+def geometry_rings(geometry: dict) -> List[Polygon]:
+    """
+    Collect the rings of a GeoJSON Polygon or MultiPolygon geometry.
+
+    Outer rings and holes are not told apart, the even-odd rule of
+    `polygon_row_spans` handles both.
+
+    :param geometry: GeoJSON geometry object.
+    :return: List of Polygon objects, one per ring.
+    """
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        raise ValueError(f'Unsupported geometry type {geometry["type"]}.')
+    rings = [Polygon(ring) for polygon in polygons for ring in polygon]
+    if not rings or any(len(ring) < 3 for ring in rings):
+        raise ValueError('Too few points.')
+    return rings
+
+
+def polygon_row_spans(
+        rings: List[Polygon], shape: Tuple[int, int]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rasterize any set of rings into column spans with one scanline pass,
+    using the even-odd rule, so polygons may be concave and have holes and
+    a MultiPolygon is just more rings.
+
+    Cell ``(r, c)`` is inside if the point ``(r, c)`` is, points on a lower
+    or right boundary are not, so that adjacent polygons share no cell.
+
+    :param rings: Rings, in any orientation, closed or not.
+    :param shape: Shape of the raster, used for clipping.
+    :return: ``(rows, lo, hi)``, where span ``i`` covers the columns
+             ``[lo[i], hi[i])`` of row ``rows[i]``.
+    """
+    starts = np.concatenate([ring.vertices for ring in rings]) \
+        .astype(np.float64)
+    ends = np.concatenate([np.roll(ring.vertices, -1, axis=0)
+                           for ring in rings]).astype(np.float64)
+    x1, y1 = starts[:, 0], starts[:, 1]
+    x2, y2 = ends[:, 0], ends[:, 1]
+
+    # an edge crosses the rows r with min(x1, x2) <= r < max(x1, x2), so a
+    # shared vertex is counted once and horizontal edges never
+    rows, cols = shape
+    first = np.clip(np.ceil(np.minimum(x1, x2)), 0, rows).astype(np.int64)
+    last = np.clip(np.ceil(np.maximum(x1, x2)), 0, rows).astype(np.int64)
+    counts = last - first
+    edge = np.repeat(np.arange(len(counts)), counts)
+    xs = first[edge] + np.arange(counts.sum()) \
+        - np.repeat(np.cumsum(counts) - counts, counts)
+    ys = y1[edge] + (xs - x1[edge]) * (y2 - y1)[edge] / (x2 - x1)[edge]
+
+    # every row has an even number of crossings, so after sorting they pair
+    # up into spans
+    order = np.lexsort((ys, xs))
+    xs = xs[order]
+    ys = np.clip(np.ceil(ys[order]), 0, cols).astype(np.int64)
+    return xs[::2], ys[::2], ys[1::2]
+
+
+def calc_whole_polygon(rings: List[Polygon], data_accessor):
+    """
+    Sum the population inside arbitrary polygons, see `polygon_row_spans`.
+
+    :param rings: Rings of the polygons, e.g. from `geometry_rings`.
+    :param data_accessor: DataAccessor object.
+    :return: Population inside the polygons.
+    """
+    with stage('rasterize'):
+        rows, lo, hi = polygon_row_spans(
+            rings, data_accessor._data_processed.shape
+        )
+    with stage('lookup'):
+        return data_accessor.query_spans(rows, lo, hi)
+
+
+def calc_batch(regions: List[Union[Convex, List[Polygon]]], data_accessor):
+    """
+    Sum the population of many regions at once.
+
+    The row spans of all regions are read from the row-wise prefix sums in a
+    single fancy-indexed lookup, and the sums are split back per region with
+    `np.bincount`. `np.unique` only drops lookups of the very same cell, e.g.
+    by regions sharing an edge. Convexes get the same spans and cells as from
+    the engines in `ROW_SPAN_ENGINES`.
+
+    :param regions: Convexes from `calc_convex`, or lists of rings as from
+                    `geometry_rings`.
+    :param data_accessor: DataAccessor object.
+    :return: Population inside every region.
+    """
+    if not regions:
+        return []
+    data = data_accessor._data_processed
+    rows, cols = data.shape
+    spans = []
+    with stage('rasterize'):
+        for region in regions:
+            if isinstance(region, list) and isinstance(region[0], Polygon):
+                spans.append(polygon_row_spans(region, data.shape))
+            else:
+                first_row, lo, hi = convex_row_spans(region, data.shape)
+                spans.append((np.arange(first_row, first_row + len(lo)),
+                              lo, hi + 1))
+    region = np.repeat(np.arange(len(spans)), [len(s[0]) for s in spans])
+    span_rows, lo, hi = (np.concatenate(a) for a in zip(*spans))
+    keep = (lo < hi) & (span_rows >= 0)
+    region, span_rows, lo, hi = region[keep], span_rows[keep], lo[keep], \
+        hi[keep]
+
+    # a lookup left of column 0 is encoded as -1 and reads 0
+    ends = span_rows * cols + hi - 1
+    starts = np.where(lo > 0, span_rows * cols + lo - 1, -1)
+    keys, inverse = np.unique(np.concatenate((ends, starts)),
+                              return_inverse=True)
+    values = np.zeros(len(keys))
+    valid = keys >= 0
+    with stage('lookup'):
+        values[valid] = data[keys[valid] // cols, keys[valid] % cols]
+    ends, starts = values[inverse].reshape(2, -1)
+    return np.bincount(region, ends - starts, minlength=len(spans)).tolist()
+
+
+def calc_batch_by_engine(regions: List[Union[Convex, List[Polygon]]],
+                        engine: str, data_accessor):
+    """
+    Sum the population of many regions one by one, convexes with a query
+    engine, for the engines whose totals `calc_batch` does not reproduce.
+
+    :param regions: As for `calc_batch`.
+    :param engine: Key of `ENGINES`.
+    :param data_accessor: DataAccessor object.
+    :return: Population inside every region.
+    """
+    return [
+        calc_whole_polygon(region, data_accessor)
+        if isinstance(region, list) and isinstance(region[0], Polygon)
+        else ENGINES[engine](region, data_accessor)
+        for region in regions
+    ]
+
+
+def calc_grid(convex, min_x, max_x, min_y, max_y, width, data_accessor):
+    """
+    Sum the population of every grid cell over the bounding box at once.
+
+    Cells are ``width x width`` and half-open, starting at `grid_origin`,
+    i.e. ``(min_x, min_y)`` rounded down to the blocks of the pyramid level
+    used, so the grid still covers the bounding box.
+    A cell is kept if any of its corners lies in the convex, otherwise it is
+    marked as -1.
+
+    :param convex: Convex, in counter-clockwise order.
+    :param min_x: First row of the grid.
+    :param max_x: Last row the grid has to cover.
+    :param min_y: First column of the grid.
+    :param max_y: Last column the grid has to cover.
+    :param width: Side length of a cell.
+    :param data_accessor: DataAccessor object.
+    :return: Matrix of cell sums.
+    """
+    return calc_grid_rows(convex, min_x, max_x, min_y, max_y, width,
+                          0, None, data_accessor)
+
+
+def grid_origin(min_x, min_y, width, data_accessor) -> Tuple:
+    """
+    First corner of the grid of `calc_grid`, which every grid line is then
+    aligned to the blocks of the pyramid level from.
+
+    :return: ``(x, y)``, less than ``width / 4`` before ``(min_x, min_y)``.
+    """
+    factor, _ = data_accessor.coarsest_level(width)
+    if factor == 1:
+        return min_x, min_y
+    return min_x - min_x % factor, min_y - min_y % factor
+
+
+def _grid_corners(min_x, max_x, min_y, max_y, width, data_accessor):
+    factor, sat = data_accessor.coarsest_level(width)
+    min_x, min_y = grid_origin(min_x, min_y, width, data_accessor)
+    corner_x = np.arange(min_x, max_x + width + 1, width)
+    corner_y = np.arange(min_y, max_y + width + 1, width)
+    return factor, sat, corner_x, corner_y
+
+
+def grid_shape(min_x, max_x, min_y, max_y, width, data_accessor):
+    """
+    Shape of the matrix `calc_grid` returns.
+    """
+    _, _, corner_x, corner_y = _grid_corners(min_x, max_x, min_y, max_y,
+                                             width, data_accessor)
+    return len(corner_x) - 1, len(corner_y) - 1
+
+
+def calc_grid_rows(convex, min_x, max_x, min_y, max_y, width, first, last,
+                   data_accessor):
+    """
+    Rows ``[first, last)`` of the matrix of `calc_grid`, so that a large grid
+    can be computed and sent in bands.
+
+    :param first: First row of the band.
+    :param last: End of the band, None for the last row of the grid.
+    :return: Matrix of cell sums of the band.
+    """
+    factor, sat, corner_x, corner_y = _grid_corners(
+        min_x, max_x, min_y, max_y, width, data_accessor
+    )
+    corner_x = corner_x[first:None if last is None else last + 1]
+    rows, cols = data_accessor._data_processed.shape
+
+    with stage('rasterize'):
+        corners = np.stack(np.meshgrid(corner_x, corner_y, indexing='ij'),
+                           -1)
+        inside = points_in_convex(corners.reshape(-1, 2), convex) \
+            .reshape(corners.shape[:2])
+        valid = (inside[:-1, :-1] | inside[1:, :-1]
+                 | inside[:-1, 1:] | inside[1:, 1:])
+
+    with stage('lookup'):
+        table = sat[np.ix_(-(-np.clip(corner_x, 0, rows) // factor),
+                           -(-np.clip(corner_y, 0, cols) // factor))]
+    cells = table[1:, 1:] - table[:-1, 1:] - table[1:, :-1] + table[:-1, :-1]
+    return np.where(valid, cells, -1)
+
+
+# engines that sum the same cells as `calc_batch`
+ROW_SPAN_ENGINES = ('sat', 'vectorized')
+
+ENGINES = {
+    'legacy': calc_whole_convex,
+    'sat': calc_whole_convex_sat,
+    'vectorized': calc_whole_convex_vectorized,
+    'exact': calc_whole_convex_exact,
+}
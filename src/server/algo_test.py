@@ -0,0 +1,322 @@
+from .algo import *
+from config import CONFIG
+
+from types import SimpleNamespace
+
+import numpy as np
+import tempfile
+import unittest
+
+
+def make_accessor(tile=8, seed=0):
+    """
+    Preprocess a synthetic raster of eight ``tile x tile`` tiles into a
+    temporary instance directory and map it.
+    """
+    rng = np.random.default_rng(seed)
+    dm = DataManipulator()
+    dm._data_raw = [
+        rng.integers(0, 100, (tile, tile)).astype(np.float32)
+        for _ in range(8)
+    ]
+    dm._data_raw[0][0, 0] = -9999
+    dm.process()
+    dm.save()
+    return DataAccessor()
+
+
+def brute_force(raw, convex):
+    """
+    Sum a convex cell by cell, rasterizing every edge with the same
+    truncation rule as the engines.
+    """
+    spans = {}
+    for p1, p2 in zip(convex, convex[1:]):
+        if p1.x == p2.x:
+            cells = [(p1.x, p1.y), (p1.x, p2.y)]
+        else:
+            k = (p2.y - p1.y) / (p2.x - p1.x)
+            b = p1.y - k * p1.x
+            cells = [(x, int(k * x + b))
+                     for x in range(min(p1.x, p2.x), max(p1.x, p2.x) + 1)]
+        for x, y in cells:
+            lo, hi = spans.get(x, (y, y))
+            spans[x] = (min(lo, y), max(hi, y))
+    return sum(raw[x, lo:hi + 1].sum() for x, (lo, hi) in spans.items())
+
+
+class AlgoTest(unittest.TestCase):
+    def setUp(self):
+        self.instance_dir = CONFIG.INSTANCE_DIR
+        self.tmp = tempfile.TemporaryDirectory()
+        CONFIG.INSTANCE_DIR = self.tmp.name
+        self.da = make_accessor()
+        self.raw = np.diff(self.da._data_processed, axis=1, prepend=0)
+
+    def tearDown(self):
+        CONFIG.INSTANCE_DIR = self.instance_dir
+        del self.da
+        self.tmp.cleanup()
+
+    def convex(self, coords):
+        return calc_convex([Point2D(x, y) for x, y in coords])
+
+    def test_query_rect(self):
+        self.assertAlmostEqual(
+            self.raw[3:11, 5:20].sum(), self.da.query_rect(3, 11, 5, 20)
+        )
+        self.assertAlmostEqual(
+            self.raw.sum(), self.da.query_rect(0, 16, 0, 32)
+        )
+
+    def test_rectangle(self):
+        convex = self.convex(((2, 3), (9, 3), (9, 20), (2, 20)))
+        expected = self.raw[2:10, 3:21].sum()
+        for name, engine in ENGINES.items():
+            if name == 'exact':
+                # vertices are cell corners there, see test_exact
+                continue
+            self.assertAlmostEqual(expected, engine(convex, self.da), places=3)
+
+    def test_polygon(self):
+        convex = self.convex(((0, 10), (7, 1), (15, 12), (11, 31), (3, 25)))
+        expected = brute_force(self.raw, convex)
+        for engine in (calc_whole_convex_sat, calc_whole_convex_vectorized):
+            self.assertAlmostEqual(expected, engine(convex, self.da), places=3)
+
+    def test_polygon_container(self):
+        coords = ((0, 10), (7, 1), (15, 12), (11, 31), (3, 25), (6, 12))
+        convex = self.convex(coords)
+        polygon = calc_convex(Polygon(coords))
+        self.assertIsInstance(polygon, Polygon)
+        self.assertEqual(convex, list(polygon))
+        for engine in ENGINES.values():
+            self.assertEqual(engine(convex, self.da), engine(polygon, self.da))
+        for p in (Point2D(6, 12), Point2D(0, 0), Point2D(15, 12)):
+            self.assertEqual(point_in_convex_linear(p, convex),
+                             point_in_convex_linear(p, polygon))
+            self.assertEqual(point_in_convex(p, convex),
+                             point_in_convex(p, polygon))
+
+    def test_points_in_convex(self):
+        rng = np.random.default_rng(1)
+        points = rng.integers(-5, 40, (2000, 2))
+        for coords in (((0, 10), (7, 1), (15, 12), (11, 31), (3, 25)),
+                       ((2, 3), (9, 3), (9, 20), (2, 20)),
+                       ((1, 1), (8, 8), (4, 4)),
+                       ((5, 5), (5, 5), (5, 5))):
+            convex = self.convex(coords)
+            expected = [point_in_convex_linear(Point2D(x, y), convex)
+                        for x, y in points.tolist()]
+            if len(convex) > 3:
+                self.assertEqual(expected, [
+                    point_in_convex(Point2D(x, y), convex)
+                    for x, y in points.tolist()
+                ])
+            else:
+                # the linear test accepts the whole line of a segment
+                expected = [e and min(coords) <= (x, y) <= max(coords)
+                            for e, (x, y) in zip(expected, points.tolist())]
+            self.assertEqual(expected,
+                             points_in_convex(points, convex).tolist())
+
+    def test_exact(self):
+        convex = self.convex(((2, 3), (9, 3), (9, 20), (2, 20)))
+        self.assertAlmostEqual(self.raw[2:9, 3:20].sum(),
+                               calc_whole_convex_exact(convex, self.da))
+
+        # uniform density: the total is the area of the polygon
+        ones = SimpleNamespace(_data_processed=np.cumsum(
+            np.ones((16, 32)), axis=1
+        ))
+        polygon = calc_convex(Polygon(
+            [(0.5, 10.25), (7.3, 1), (15.5, 12), (11, 31.9), (3.2, 25)]
+        ))
+        coords = polygon.coords
+        area = abs(sum(coords[i - 1][0] * coords[i][1]
+                       - coords[i][0] * coords[i - 1][1]
+                       for i in range(len(coords)))) / 2
+        self.assertAlmostEqual(area, calc_whole_convex_exact(polygon, ones))
+
+        # random density: compare with supersampling every cell
+        n = 32
+        offsets = (np.arange(n) + .5) / n
+        sub = np.stack(np.meshgrid(offsets, offsets, indexing='ij'), -1)
+        expected = 0
+        for r in range(16):
+            for c in range(32):
+                inside = points_in_convex(sub.reshape(-1, 2) + (r, c), polygon)
+                expected += inside.mean() * self.raw[r, c]
+        self.assertAlmostEqual(
+            1, calc_whole_convex_exact(polygon, self.da) / expected, places=2
+        )
+
+    def test_scanline(self):
+        outer = [(2, 3), (9, 3), (9, 20), (2, 20), (2, 3)]
+        hole = [(4, 6), (4, 10), (7, 10), (7, 6), (4, 6)]
+        rings = geometry_rings({'type': 'Polygon',
+                                'coordinates': [outer, hole]})
+        self.assertAlmostEqual(
+            self.raw[2:9, 3:20].sum() - self.raw[4:7, 6:10].sum(),
+            calc_whole_polygon(rings, self.da)
+        )
+
+        # concave, plus a second polygon partly off the raster
+        ell = [(0, 0), (10, 0), (10, 5), (5, 5), (5, 15), (0, 15)]
+        off = [(12, 25), (20, 25), (20, 40), (12, 40)]
+        rings = geometry_rings({'type': 'MultiPolygon',
+                                'coordinates': [[ell], [off]]})
+        self.assertAlmostEqual(
+            self.raw[0:10, 0:5].sum() + self.raw[0:5, 5:15].sum()
+            + self.raw[12:, 25:].sum(),
+            calc_whole_polygon(rings, self.da)
+        )
+
+        # no cell lies on the boundary, so any convex engine agrees
+        triangle = [(0.5, 1.5), (14.5, 10.5), (3.5, 30.25)]
+        polygon = calc_convex(Polygon(triangle))
+        cells = np.argwhere(np.ones_like(self.raw, dtype=bool))
+        expected = self.raw.ravel()[points_in_convex(cells, polygon)].sum()
+        self.assertAlmostEqual(
+            expected, calc_whole_polygon([Polygon(triangle)], self.da)
+        )
+
+        with self.assertRaises(ValueError):
+            geometry_rings({'type': 'Point', 'coordinates': [0, 0]})
+        with self.assertRaises(ValueError):
+            geometry_rings({'type': 'Polygon', 'coordinates': [[(0, 0)]]})
+
+    def test_batch(self):
+        regions = [
+            self.convex(((0, 10), (7, 1), (15, 12), (11, 31), (3, 25))),
+            calc_convex(Polygon(((2, 3), (9, 3), (9, 20), (2, 20)))),
+            self.convex(((-5, -5), (40, -5), (-5, 60))),
+            geometry_rings({'type': 'Polygon', 'coordinates': [
+                [(2, 3), (9, 3), (9, 20), (2, 20)],
+                [(4, 6), (4, 10), (7, 10), (7, 6)],
+            ]}),
+        ]
+        expected = [calc_whole_convex_vectorized(region, self.da)
+                    for region in regions[:2]]
+        expected.append(calc_whole_polygon(
+            [Polygon(((0, 0), (16, 0), (16, 32), (0, 32)))], self.da
+        ))
+        expected.append(calc_whole_polygon(regions[3], self.da))
+        ans = calc_batch(regions, self.da)
+        for a, b in zip(expected, ans):
+            self.assertAlmostEqual(a, b, places=3)
+        self.assertEqual([], calc_batch([], self.da))
+
+        # the legacy engine reads outside of the raster
+        del regions[2], expected[2]
+        for engine in ENGINES:
+            ans = calc_batch_by_engine(regions, engine, self.da)
+            for region, a, b in zip(regions, expected, ans):
+                if engine in ROW_SPAN_ENGINES or region is regions[-1]:
+                    self.assertAlmostEqual(a, b, places=3)
+                else:
+                    self.assertAlmostEqual(
+                        ENGINES[engine](region, self.da), b, places=3
+                    )
+
+    def test_clipped(self):
+        convex = self.convex(((10, 20), (16, 20), (16, 32), (10, 32)))
+        expected = self.raw[10:, 20:].sum()
+        for engine in (calc_whole_convex_sat, calc_whole_convex_vectorized):
+            self.assertAlmostEqual(expected, engine(convex, self.da), places=3)
+
+    def test_exact_clipped(self):
+        # uniform density: the total is the area of the convex cut to the
+        # raster, i.e. clipped by its four sides (Sutherland-Hodgman)
+        ones = SimpleNamespace(_data_processed=np.cumsum(
+            np.ones((16, 32)), axis=1
+        ))
+        polygon = calc_convex(Polygon(
+            [(-2.5, -3.2), (5.5, -1), (20.25, 40), (3, 36.5)]
+        ))
+        poly = polygon.coords[:-1]
+        for axis, value, keep_greater in ((0, 0, True), (0, 16, False),
+                                          (1, 0, True), (1, 32, False)):
+            def inside(p):
+                return p[axis] >= value if keep_greater else p[axis] <= value
+
+            clipped = []
+            for prev, cur in zip(poly[-1:] + poly[:-1], poly):
+                if inside(cur) != inside(prev):
+                    t = (value - prev[axis]) / (cur[axis] - prev[axis])
+                    other = prev[1 - axis] + t * (cur[1 - axis]
+                                                  - prev[1 - axis])
+                    clipped.append((value, other) if axis == 0
+                                   else (other, value))
+                if inside(cur):
+                    clipped.append(cur)
+            poly = clipped
+        area = abs(sum(poly[i - 1][0] * poly[i][1]
+                       - poly[i][0] * poly[i - 1][1]
+                       for i in range(len(poly)))) / 2
+        self.assertAlmostEqual(area, calc_whole_convex_exact(polygon, ones))
+
+    def test_negative_rows(self):
+        convex = self.convex(((-3, 0), (2, 0), (2, 2), (-3, 2)))
+        [expected] = calc_batch([convex], self.da)
+        self.assertAlmostEqual(self.raw[:3, :3].sum(), expected, places=3)
+        for engine in (calc_whole_convex_sat, calc_whole_convex_vectorized):
+            self.assertAlmostEqual(expected, engine(convex, self.da), places=3)
+        # the exact engine covers the half-open cells [0, 2) x [0, 2)
+        self.assertAlmostEqual(self.raw[:2, :2].sum(),
+                               calc_whole_convex_exact(convex, self.da),
+                               places=3)
+
+    def check_grid(self, width, origin, aligned_origin):
+        convex = self.convex(((1, 4), (12, 2), (14, 29), (3, 20)))
+        grid = calc_grid(convex, origin[0], 14, origin[1], 29, width, self.da)
+
+        self.assertEqual(aligned_origin,
+                         grid_origin(*origin, width, self.da))
+        xs = range(aligned_origin[0], 14 + 1, width)
+        ys = range(aligned_origin[1], 29 + 1, width)
+        self.assertEqual((len(xs), len(ys)), grid.shape)
+        for i, x in enumerate(xs):
+            for j, y in enumerate(ys):
+                corners = [Point2D(x + dx, y + dy)
+                           for dx in (0, width) for dy in (0, width)]
+                if any(point_in_convex_linear(p, convex) for p in corners):
+                    expected = self.raw[x:x + width, y:y + width].sum()
+                else:
+                    expected = -1
+                self.assertAlmostEqual(expected, grid[i, j], places=3)
+
+    def test_grid(self):
+        self.check_grid(5, (1, 2), (1, 2))
+
+    def test_grid_pyramid(self):
+        self.assertEqual(2, self.da.coarsest_level(12)[0])
+        self.assertEqual(1, self.da.coarsest_level(6)[0])
+        self.assertEqual(4, self.da.coarsest_level(16)[0])
+        self.check_grid(4, (1, 2), (1, 2))
+        self.check_grid(8, (1, 3), (0, 2))
+        self.check_grid(12, (3, 5), (2, 4))
+        self.check_grid(16, (1, 2), (0, 0))
+
+    def test_grid_coarse_level(self):
+        # an origin off the blocks still reads the level picked by the width
+        pyramid = self.da._pyramid
+        self.da._pyramid = {**pyramid, 1: np.full_like(pyramid[1], np.nan),
+                            4: np.full_like(pyramid[4], np.nan)}
+        try:
+            self.check_grid(8, (3, 5), (2, 4))
+        finally:
+            self.da._pyramid = pyramid
+
+    def test_grid_rows(self):
+        convex = self.convex(((0, 10), (7, 1), (15, 12), (11, 31), (3, 25)))
+        args = (convex, 0, 15, 1, 31, 3)
+        grid = calc_grid(*args, self.da)
+        self.assertEqual(grid.shape, grid_shape(*args[1:], self.da))
+        bands = [calc_grid_rows(*args, first, first + 2, self.da)
+                 for first in range(0, len(grid), 2)]
+        np.testing.assert_array_equal(grid, np.concatenate(bands))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+from projection import Polygon
+
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import time
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of query results with an optional time to live.
+
+    It is only touched from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, max_size: int, ttl: float = 0):
+        """
+        :param max_size: Maximum number of entries, 0 disables the cache.
+        :param ttl: Seconds an entry stays valid, 0 for no expiry.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Look up a result, refreshing its recency.
+
+        :param key: Cache key.
+        :return: Cached result, or None on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires = entry
+            if not expires or expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Store a result, evicting the least recently used one when full.
+
+        :param key: Cache key.
+        :param value: Result, must not be None.
+        :return: None
+        """
+        if self.max_size <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def hull_key(convex, *extra) -> tuple:
+    """
+    Canonical cache key of a query. `calc_convex` returns the same vertex
+    sequence for any ordering of the input points, so the hull identifies the
+    region.
+
+    :param convex: Convex returned by `calc_convex`.
+    :param extra: Other parameters of the query, e.g. the grid width.
+    :return: Hashable key.
+    """
+    if isinstance(convex, Polygon):
+        return tuple(convex.coords), *extra
+    return tuple((p.x, p.y) for p in convex), *extra
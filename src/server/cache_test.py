@@ -0,0 +1,49 @@
+from .cache import *
+from projection import Point2D, Polygon
+
+import unittest
+from unittest import mock
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = ResultCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(
+            {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1},
+            cache.stats()
+        )
+
+    def test_ttl(self):
+        cache = ResultCache(2, ttl=10)
+        with mock.patch('time.monotonic', return_value=100):
+            cache.put('a', 1)
+        with mock.patch('time.monotonic', return_value=105):
+            self.assertEqual(1, cache.get('a'))
+        with mock.patch('time.monotonic', return_value=111):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, len(cache))
+
+    def test_disabled(self):
+        cache = ResultCache(0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_hull_key(self):
+        convex = [Point2D(0, 0), Point2D(1, 0), Point2D(0, 1), Point2D(0, 0)]
+        self.assertEqual(
+            (((0, 0), (1, 0), (0, 1), (0, 0)), 'grid', 5),
+            hull_key(convex, 'grid', 5)
+        )
+        self.assertEqual(hull_key(convex),
+                         hull_key(Polygon.from_points(convex)))
+
+
+if __name__ == '__main__':
+    unittest.main()
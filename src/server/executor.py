@@ -0,0 +1,126 @@
+from .algo import DataAccessor
+from .metrics import Metrics, record_stages
+from config import CONFIG, Config
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+# DataAccessor of the current query process, see `_init_process`.
+_data_accessor = None
+
+
+def _init_process(config: Config):
+    """
+    Initializer of every query process: map the preprocessed data, sharing
+    the page cache with the server and the other query processes.
+
+    :param config: Configuration of the server.
+    :return: None
+    """
+    global _data_accessor
+    CONFIG.update(config)
+    _data_accessor = DataAccessor()
+
+
+def _timed_call(func, args, submitted):
+    """
+    Call ``func(*args)``, timing how long it waited in the pool, how long it
+    ran, and the stages it timed itself. The monotonic clock is shared by
+    processes, so the wait is measured across them too.
+    """
+    started = time.monotonic()
+    with record_stages() as stages:
+        result = func(*args)
+    return result, started - submitted, time.monotonic() - started, stages
+
+
+def _run_in_process(func, submitted, *args):
+    return _timed_call(func, (*args, _data_accessor), submitted)
+
+
+class QueryExecutor:
+    """
+    Runs query functions, called as ``func(*args, data_accessor)``, off the
+    event loop.
+
+    The ``thread`` backend shares the server's DataAccessor between threads,
+    so CPU-bound queries serialize on the GIL. The ``process`` backend runs
+    them in a ProcessPoolExecutor whose processes each map the same files.
+    """
+
+    BACKENDS = ('thread', 'process')
+
+    def __init__(self, data_accessor: DataAccessor, backend: str,
+                 pool_size: int, metrics: Metrics = None):
+        """
+        :param data_accessor: DataAccessor used by the thread backend.
+        :param backend: ``thread`` or ``process``.
+        :param pool_size: Number of workers, 0 for the executor's default.
+        :param metrics: Registry receiving the timings of every query.
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f'Invalid executor backend: {backend}')
+
+        self.backend = backend
+        self.metrics = metrics
+        self.pending = 0
+        self._data_accessor = data_accessor
+        # the defaults of the executors, resolved here so that they can be
+        # reported
+        cpus = os.cpu_count() or 1
+        self.workers = pool_size or (
+            cpus if backend == 'process' else min(32, cpus + 4)
+        )
+        if backend == 'process':
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_process,
+                initargs=(CONFIG,),
+            )
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        logging.info(f'Query executor started: {backend}, '
+                     f'{self.workers} workers.')
+
+    async def run(self, func, *args):
+        """
+        Run ``func(*args, data_accessor)`` in the pool.
+
+        :param func: Picklable query function.
+        :param args: Arguments before the DataAccessor.
+        :return: Result of the function.
+        """
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            if self.backend == 'process':
+                ret = await loop.run_in_executor(
+                    self._pool, _run_in_process, func, time.monotonic(), *args
+                )
+            else:
+                ret = await loop.run_in_executor(
+                    self._pool, _timed_call, func,
+                    (*args, self._data_accessor), time.monotonic()
+                )
+        finally:
+            self.pending -= 1
+
+        result, wait, run, stages = ret
+        if self.metrics is not None:
+            query = func.__name__
+            observe = self.metrics.observe
+            observe('query_stage_seconds', wait, query=query, stage='queue')
+            observe('query_stage_seconds', run, query=query, stage='run')
+            for name, seconds in stages:
+                observe('query_stage_seconds', seconds, query=query,
+                        stage=name)
+        return result
+
+    def shutdown(self):
+        self._pool.shutdown(cancel_futures=True)
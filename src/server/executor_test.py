@@ -0,0 +1,71 @@
+from .algo_test import make_accessor
+from .executor import *
+from .metrics import Metrics
+from .algo import Point2D, calc_convex, calc_whole_convex_sat
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+
+class QueryExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.instance_dir = CONFIG.INSTANCE_DIR
+        self.tmp = tempfile.TemporaryDirectory()
+        CONFIG.INSTANCE_DIR = self.tmp.name
+        self.da = make_accessor()
+        self.convex = calc_convex([
+            Point2D(x, y) for x, y in ((0, 10), (7, 1), (15, 12), (11, 31))
+        ])
+
+    def tearDown(self):
+        CONFIG.INSTANCE_DIR = self.instance_dir
+        del self.da
+        self.tmp.cleanup()
+
+    def run_backend(self, backend):
+        executor = QueryExecutor(self.da, backend, 2)
+        try:
+            return asyncio.run(
+                executor.run(calc_whole_convex_sat, self.convex)
+            )
+        finally:
+            executor.shutdown()
+
+    def test_backends(self):
+        expected = calc_whole_convex_sat(self.convex, self.da)
+        for backend in QueryExecutor.BACKENDS:
+            self.assertAlmostEqual(expected, self.run_backend(backend))
+
+    def test_metrics(self):
+        metrics = Metrics()
+        for backend in QueryExecutor.BACKENDS:
+            executor = QueryExecutor(self.da, backend, 2, metrics)
+            try:
+                asyncio.run(executor.run(calc_whole_convex_sat, self.convex))
+            finally:
+                executor.shutdown()
+            self.assertEqual(0, executor.pending)
+
+        histograms = metrics._histograms['query_stage_seconds']
+        for name in ('queue', 'run', 'rasterize', 'lookup'):
+            key = (('query', 'calc_whole_convex_sat'), ('stage', name))
+            self.assertEqual(2, histograms[key].count)
+
+    def test_workers(self):
+        cpus = os.cpu_count() or 1
+        for backend, pool_size, workers in (
+                ('thread', 3, 3), ('thread', 0, min(32, cpus + 4)),
+                ('process', 0, cpus)):
+            executor = QueryExecutor(self.da, backend, pool_size)
+            executor.shutdown()
+            self.assertEqual(workers, executor.workers)
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            QueryExecutor(self.da, 'fiber', 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import bisect
+import math
+import threading
+import time
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25,
+           .5, 1, 2.5, 5, 10)
+
+_stages = threading.local()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a stage of a query, e.g. ``with stage('lookup'): ...``.
+
+    The time is only kept while the query runs under `record_stages`, so
+    query functions can be instrumented unconditionally.
+
+    :param name: Name of the stage.
+    """
+    records: Optional[List] = getattr(_stages, 'records', None)
+    if records is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        records.append((name, time.perf_counter() - start))
+
+
+@contextmanager
+def record_stages():
+    """
+    Collect the stages timed by `stage` in this thread.
+
+    :return: Context manager giving the list of ``(stage, seconds)``.
+    """
+    outer = getattr(_stages, 'records', None)
+    _stages.records = []
+    try:
+        yield _stages.records
+    finally:
+        _stages.records = outer
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    In-process registry of counters, gauges and histograms, rendered in the
+    Prometheus text format.
+
+    Metrics are identified by name and a tuple of label pairs. All updates
+    take a lock, since queries of the thread backend report from the pool.
+    """
+
+    def __init__(self, prefix: str = ''):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Tuple, Histogram]] = {}
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = Histogram()
+            histograms[key].observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + value
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self, gauges: Dict[str, float] = None,
+               counters: Dict[str, float] = None) -> str:
+        """
+        Render all metrics.
+
+        :param gauges: Current values to append, e.g. cache sizes, by name
+                       with the prefix left out.
+        :param counters: Same for totals counted elsewhere, e.g. cache hits,
+                         named with a ``_total`` suffix.
+        :return: Prometheus text exposition.
+        """
+        lines = []
+
+        def header(name, kind):
+            if name in self._help:
+                lines.append(f'# HELP {self.prefix}{name} {self._help[name]}')
+            lines.append(f'# TYPE {self.prefix}{name} {kind}')
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                header(name, 'counter')
+                for key, value in sorted(series.items()):
+                    lines.append(f'{self.prefix}{name}{_labels(key)} '
+                                 f'{_number(value)}')
+
+            for name, histograms in sorted(self._histograms.items()):
+                header(name, 'histogram')
+                for key, h in sorted(histograms.items()):
+                    total = 0
+                    for bound, count in zip(h.buckets + (math.inf,),
+                                            h.counts):
+                        total += count
+                        le = (('le', _number(bound)),)
+                        lines.append(f'{self.prefix}{name}_bucket'
+                                     f'{_labels(key + le)} {total}')
+                    lines.append(f'{self.prefix}{name}_sum{_labels(key)} '
+                                 f'{_number(h.sum)}')
+                    lines.append(f'{self.prefix}{name}_count{_labels(key)} '
+                                 f'{h.count}')
+
+        for kind, current in (('counter', counters), ('gauge', gauges)):
+            for name, value in sorted((current or {}).items()):
+                header(name, kind)
+                lines.append(f'{self.prefix}{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(key: Tuple) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+        for k, v in key
+    ) + '}'
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
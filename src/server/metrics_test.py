@@ -0,0 +1,55 @@
+from .metrics import *
+
+import unittest
+
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram(self):
+        h = Histogram((1, 2))
+        for value in (.5, 1, 1.5, 3):
+            h.observe(value)
+        self.assertEqual([2, 1, 1], h.counts)
+        self.assertEqual(6, h.sum)
+        self.assertEqual(4, h.count)
+
+    def test_render(self):
+        metrics = Metrics('p_')
+        metrics.describe('requests_total', 'Requests answered.')
+        metrics.inc('requests_total', endpoint='/a', status=200)
+        metrics.inc('requests_total', endpoint='/a', status=200)
+        metrics.observe('seconds', .003, stage='run')
+        lines = metrics.render({'pending': 2},
+                               {'hits_total': 3}).splitlines()
+
+        self.assertEqual([
+            '# HELP p_requests_total Requests answered.',
+            '# TYPE p_requests_total counter',
+            'p_requests_total{endpoint="/a",status="200"} 2.0',
+            '# TYPE p_seconds histogram',
+        ], lines[:4])
+        self.assertIn('p_seconds_bucket{stage="run",le="0.0025"} 0', lines)
+        self.assertIn('p_seconds_bucket{stage="run",le="0.005"} 1', lines)
+        self.assertIn('p_seconds_bucket{stage="run",le="+Inf"} 1', lines)
+        self.assertIn('p_seconds_count{stage="run"} 1', lines)
+        self.assertEqual(['# TYPE p_hits_total counter', 'p_hits_total 3.0',
+                          '# TYPE p_pending gauge', 'p_pending 2.0'],
+                         lines[-4:])
+
+    def test_stages(self):
+        with stage('ignored'):
+            pass
+        with record_stages() as stages:
+            with stage('lookup'):
+                pass
+            with record_stages() as inner:
+                with stage('encode'):
+                    pass
+        self.assertEqual(['lookup'], [name for name, _ in stages])
+        self.assertEqual(['encode'], [name for name, _ in inner])
+        with stage('ignored'):
+            pass
+        self.assertEqual(1, len(stages))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+from collections import Counter
+from typing import Optional
+
+import logging
+import os
+import sys
+import threading
+import time
+
+
+def collapse(frame, thread: str = None) -> str:
+    """
+    Collapsed stack of a frame, outermost first, e.g.
+    ``MainThread;server.py:run;algo.py:calc_grid_rows``.
+
+    :param frame: Innermost frame.
+    :param thread: Name of the thread, prepended as the root frame.
+    :return: Semicolon-separated frames.
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    if thread is not None:
+        frames.append(thread)
+    return ';'.join(reversed(frames))
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread of the process from a background
+    thread, so the server keeps running at almost full speed while profiled.
+
+    The samples are written in the collapsed format read by ``flamegraph.pl``
+    and speedscope, one ``stack count`` line per distinct stack. With the
+    process executor backend, the queries run in other processes and only
+    show up as waiting on the pool.
+    """
+
+    def __init__(self, interval: float):
+        """
+        :param interval: Seconds between two samples.
+        """
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, directory: str) -> Optional[str]:
+        """
+        Sample for some time in the background.
+
+        :param seconds: Duration of the profile.
+        :param directory: Directory the profile is written to.
+        :return: Path of the profile once written, or None if a profile is
+                 already running.
+        """
+        if self.running:
+            return None
+        file = os.path.join(directory, 'profile-{}-{}.folded'.format(
+            os.getpid(), time.strftime('%Y%m%d-%H%M%S')
+        ))
+        self._thread = threading.Thread(
+            target=self._run, args=(seconds, file), name='profiler',
+            daemon=True
+        )
+        self._thread.start()
+        return file
+
+    def sample(self, stacks: Counter):
+        """
+        Add the current stack of every other thread to the counts.
+
+        :param stacks: Counts by collapsed stack.
+        :return: None
+        """
+        names = {t.ident: t.name for t in threading.enumerate()}
+        current = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident != current:
+                stacks[collapse(frame, names.get(ident, str(ident)))] += 1
+
+    def _run(self, seconds: float, file: str):
+        logging.info(f'Profiling for {seconds} s...')
+        stacks = Counter()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            self.sample(stacks)
+            time.sleep(self.interval)
+
+        with open(file, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        logging.info(f'Profile of {sum(stacks.values())} samples written to '
+                     f'{file}.')
@@ -0,0 +1,48 @@
+from .profiler import *
+
+import tempfile
+import unittest
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def test_collapse(self):
+        def inner():
+            return sys._getframe()
+
+        stack = collapse(inner(), 'worker').split(';')
+        self.assertEqual('worker', stack[0])
+        self.assertEqual(['profiler_test.py:test_collapse',
+                          'profiler_test.py:inner'], stack[-2:])
+
+    def test_profile(self):
+        stop = threading.Event()
+
+        def busy():
+            while not stop.is_set():
+                sum(range(1000))
+
+        thread = threading.Thread(target=busy, name='busy')
+        thread.start()
+        profiler = SamplingProfiler(.001)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                file = profiler.start(.05, directory)
+                self.assertIsNotNone(file)
+                self.assertIsNone(profiler.start(.05, directory))
+                profiler._thread.join()
+                self.assertFalse(profiler.running)
+                with open(file) as f:
+                    lines = f.read().splitlines()
+        finally:
+            stop.set()
+            thread.join()
+
+        busy_samples = [int(line.rsplit(' ', 1)[1]) for line in lines
+                        if line.startswith('busy;')]
+        self.assertGreater(sum(busy_samples), 0)
+        self.assertTrue(all('profiler.py:_run' not in line
+                            for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,246 @@
 from .algo import *
+from .cache import ResultCache, hull_key
+from .executor import QueryExecutor
+from .metrics import Metrics
+from .profiler import SamplingProfiler
+from .tiles import TileCache, render_tile
+from config import CONFIG, Config
 from config.project_meta import __project__
+from util.codec import NPY_MIME, ORIGIN_HEADER, encode_npy
+from util.log import queue_logging, summarize
 
 from sanic import Sanic, response
+from sanic.exceptions import BadRequest
 from sanic.worker.loader import AppLoader
 from sanic.log import logger
 from functools import partial
 
 import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import signal
+import time
+import numpy as np
 
+STREAM_MAX_BAND = 64  # grid rows computed at once by /api/grid/stream
 
-def create_app():
+
+def create_metrics() -> Metrics:
+    metrics = Metrics(f'{__project__.lower()}_')
+    metrics.describe('requests_total', 'Requests answered.')
+    metrics.describe('request_seconds', 'Time from request to response, '
+                     'to the end of the body for streamed ones.')
+    metrics.describe('stage_seconds',
+                     'Time of the request stages run on the event loop.')
+    metrics.describe('query_stage_seconds',
+                     'Time of the query stages run by the executor: queue '
+                     'wait, whole run, and the stages inside the run.')
+    metrics.describe('cache_hits_total', 'Result cache hits.')
+    metrics.describe('cache_misses_total', 'Result cache misses.')
+    metrics.describe('tile_cache_hits_total', 'Tile memory cache hits.')
+    metrics.describe('tile_cache_misses_total', 'Tile memory cache misses.')
+    metrics.describe('executor_pending', 'Queries submitted, not finished.')
+    return metrics
+
+
+def endpoint(request) -> str:
+    """
+    Route of a request as a metric label, e.g. ``/tiles/<z:int>/...`` for
+    any tile, so that labels stay few.
+    """
+    if request.route is None:
+        return 'unmatched'
+    return '/' + request.route.path
+
+
+def parse_region(geometry: dict, mode: str = None):
+    """
+    Read the region of a request.
+
+    Polygons and MultiPolygons are taken as they are, concave or with holes.
+    With ``mode='convex'``, the points of the first ring are taken as
+    spanning a convex instead, as the client sends them.
+
+    :param geometry: GeoJSON geometry object.
+    :param mode: ``'convex'`` or ``'polygon'``, None for ``'polygon'``.
+    :return: ``(mode, region)``, region being a convex for ``'convex'`` and
+             a list of rings for ``'polygon'``.
+    """
+    if mode is None:
+        mode = 'polygon'
+
+    if mode == 'polygon':
+        return mode, geometry_rings(geometry)
+    if mode != 'convex':
+        raise Exception(f'Unknown mode {mode}.')
+    points = geometry['coordinates'][0]
+    if len(points) < 3:
+        raise Exception('Too few points.')
+    return mode, calc_convex(Polygon(points))
+
+
+def region_key(mode: str, region, batch: bool = False) -> tuple:
+    """
+    Cache key of a total. A batch sums convexes with row spans, which gives
+    the totals of the engines in `ROW_SPAN_ENGINES` up to rounding, so its
+    convex totals are cached apart.
+    """
+    if mode == 'polygon':
+        return tuple(tuple(ring.coords) for ring in region), 'polygon'
+    return hull_key(region, 'batch' if batch else 'total')
+
+
+def npy_response(request, array, headers: dict = None):
+    """
+    Respond with a matrix as ``.npy`` bytes, gzip-compressed if the client
+    accepts it.
+    """
+    body = encode_npy(array)
+    headers = dict(headers or {})
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        body = gzip.compress(body, compresslevel=1)
+        headers['Content-Encoding'] = 'gzip'
+    return response.raw(body, content_type=NPY_MIME, headers=headers)
+
+
+def parse_grid(body: dict) -> tuple:
+    """
+    Read the arguments of `calc_grid` from a grid request.
+
+    :param body: JSON body with ``geometry`` and ``grid_width``.
+    :return: ``(convex, min_x, max_x, min_y, max_y, width)``.
+    """
+    points = body.get('geometry')['coordinates'][0]
+    width = body.get('grid_width')
+
+    if len(points) < 3:
+        raise Exception('Too few points.')
+    if width < 1:
+        raise Exception('Grid width must be positive.')
+
+    min_x = min(p[0] for p in points)
+    max_x = max(p[0] for p in points)
+    min_y = min(p[1] for p in points)
+    max_y = max(p[1] for p in points)
+
+    convex = calc_convex(Polygon(points))
+    return convex, min_x, max_x, min_y, max_y, width
+
+
+def create_app(config: Config = CONFIG):
+    CONFIG.update(config)
     app = Sanic(f'{__project__}S')
     app.ctx.data_accessor = DataAccessor()
+    app.ctx.calc_whole_convex = ENGINES[CONFIG.QUERY_ENGINE]
+    app.ctx.cache = ResultCache(CONFIG.CACHE_SIZE, CONFIG.CACHE_TTL)
+    app.ctx.tile_cache = TileCache(
+        os.path.join(CONFIG.INSTANCE_DIR, CONFIG.TILE_CACHE_DIR),
+        str(os.stat(os.path.join(CONFIG.INSTANCE_DIR,
+                                 CONFIG.SAT_FILE)).st_mtime_ns),
+        CONFIG.TILE_CACHE_SIZE, CONFIG.TILE_DISK_CACHE_SIZE
+    )
+    app.ctx.metrics = metrics = create_metrics()
+    app.ctx.profiler = SamplingProfiler(CONFIG.PROFILE_INTERVAL)
+    log_counts = {}  # query requests seen by endpoint, for the sampling
+
+    def log_request(request):
+        """
+        Log a query request at INFO with a summary of its payload, keeping
+        one in ``1 / CONFIG.LOG_SAMPLE_RATE`` requests of each endpoint.
+        """
+        if CONFIG.LOG_SAMPLE_RATE <= 0 \
+                or not logger.isEnabledFor(logging.INFO):
+            return
+        count = log_counts.get(request.ctx.endpoint, 0)
+        log_counts[request.ctx.endpoint] = count + 1
+        if count % max(1, round(1 / CONFIG.LOG_SAMPLE_RATE)) == 0:
+            try:
+                payload = summarize(request.json, CONFIG.LOG_PAYLOAD_LIMIT)
+            except BadRequest:
+                payload = f'<malformed, {len(request.body)} bytes>'
+            logger.info('%s: %s', request.path, payload)
+
+    def start_profile(seconds: float = None):
+        # without a duration, i.e. on SIGUSR1, use the one /admin/profile
+        # shared with the other workers
+        if seconds is None:
+            shared = getattr(app.shared_ctx, 'profile_seconds', None)
+            seconds = shared.value if shared is not None \
+                else CONFIG.PROFILE_SECONDS
+        file = app.ctx.profiler.start(seconds, CONFIG.INSTANCE_DIR)
+        if file is None:
+            logger.warning('A profile is already running.')
+        return file
+
+    @app.main_process_start
+    async def share_profile_seconds(app):
+        app.shared_ctx.profile_seconds = multiprocessing.Value(
+            'd', CONFIG.PROFILE_SECONDS
+        )
+
+    @app.before_server_start
+    async def start_log_queue(app):
+        if CONFIG.LOG_QUEUE:
+            app.ctx.restore_logging = queue_logging(
+                '', 'sanic.root', 'sanic.error', 'sanic.access',
+                'sanic.server'
+            )
+
+    @app.after_server_stop
+    async def stop_log_queue(app):
+        if hasattr(app.ctx, 'restore_logging'):
+            app.ctx.restore_logging()
+
+    @app.before_server_start
+    async def start_executor(app):
+        app.ctx.executor = QueryExecutor(
+            app.ctx.data_accessor, CONFIG.EXECUTOR, CONFIG.POOL_SIZE, metrics
+        )
+
+    @app.before_server_start
+    async def handle_profile_signal(app):
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1,
+                                                          start_profile)
+        except (NotImplementedError, RuntimeError) as e:
+            logger.warning(f'Profiling on SIGUSR1 unavailable: {e}')
+
+    @app.on_request
+    async def start_timer(request):
+        request.ctx.start = time.perf_counter()
+        request.ctx.endpoint = endpoint(request)
+        if request.method == 'POST':
+            # parse the body now, so that its time is measured alone; a
+            # malformed one is left to the handler to report
+            with metrics.time('stage_seconds', endpoint=request.ctx.endpoint,
+                              stage='parse'):
+                try:
+                    request.json
+                except BadRequest:
+                    pass
+
+    def observe_request(request):
+        metrics.observe('request_seconds',
+                        time.perf_counter() - request.ctx.start,
+                        endpoint=request.ctx.endpoint)
+
+    @app.on_response
+    async def stop_timer(request, response):
+        if not hasattr(request.ctx, 'start'):
+            return
+        # a streamed response is timed once its body is sent
+        if not getattr(request.ctx, 'streamed', False):
+            observe_request(request)
+        metrics.inc('requests_total', endpoint=request.ctx.endpoint,
+                    status=response.status if response else 0)
+
+    @app.after_server_stop
+    async def stop_executor(app):
+        app.ctx.executor.shutdown()
 
     @app.get('/ping')
     async def ping_handler(request):
@@ -20,24 +249,117 @@ def create_app():
             arg.replace('i', 'o').replace('I', 'O')
         )
 
+    @app.get('/api/cache')
+    async def cache_handler(request):
+        return response.json(app.ctx.cache.stats())
+
+    @app.get('/metrics')
+    async def metrics_handler(request):
+        cache = app.ctx.cache.stats()
+        tiles = app.ctx.tile_cache.stats()
+        executor = app.ctx.executor
+        return response.text(metrics.render({
+            'cache_entries': cache['size'],
+            'tile_cache_entries': tiles['size'],
+            'tile_cache_files': tiles['files'],
+            'executor_workers': executor.workers,
+            'executor_pending': executor.pending,
+        }, {
+            'cache_hits_total': cache['hits'],
+            'cache_misses_total': cache['misses'],
+            'tile_cache_hits_total': tiles['hits'],
+            'tile_cache_misses_total': tiles['misses'],
+        }), content_type='text/plain; version=0.0.4')
+
+    if CONFIG.ADMIN_ENDPOINTS:
+        @app.post('/admin/profile')
+        async def profile_handler(request):
+            """
+            Profile every server worker for ``?seconds=`` (default
+            ``CONFIG.PROFILE_SECONDS``). Each worker writes its own
+            ``profile-{pid}-{time}.folded`` to the instance directory.
+            """
+            try:
+                seconds = float(request.args.get('seconds',
+                                                 CONFIG.PROFILE_SECONDS))
+                if not 0 < seconds <= CONFIG.PROFILE_MAX_SECONDS:
+                    raise ValueError('Profile duration must be in '
+                                     f'(0, {CONFIG.PROFILE_MAX_SECONDS}].')
+            except ValueError as e:
+                return response.json({'error': str(e)}, status=400)
+
+            shared = getattr(app.shared_ctx, 'profile_seconds', None)
+            if shared is not None:
+                shared.value = seconds
+            file = start_profile(seconds)
+            if file is None:
+                return response.json({
+                    'error': 'A profile is already running.'
+                }, status=409)
+
+            pids = [os.getpid()]
+            multiplexer = getattr(app, 'multiplexer', None)
+            workers = multiplexer.workers if multiplexer else {}
+            for worker in workers.values():
+                pid = worker.get('pid')
+                if worker.get('server') and pid and pid != os.getpid():
+                    os.kill(pid, signal.SIGUSR1)
+                    pids.append(pid)
+            logger.info(f'Profiling workers {pids} for {seconds} s.')
+            return response.json({
+                'seconds': seconds,
+                'pids': pids,
+                'directory': os.path.abspath(CONFIG.INSTANCE_DIR),
+            })
+
+    @app.get('/tiles/<z:int>/<x:int>/<y:ext=png>')
+    async def tile_handler(request, z, x, y, ext):
+        try:
+            key = (z, x, int(y))
+            png = await app.ctx.tile_cache.get_async(key)
+            if png is None:
+                png = await app.ctx.executor.run(render_tile, *key)
+                await app.ctx.tile_cache.put_async(key, png)
+            return response.raw(png, content_type='image/png', headers={
+                'Cache-Control': 'public, max-age=86400'
+            })
+
+        except (IndexError, ValueError) as e:
+            return response.json({
+                'error': str(e)
+            }, status=404)
+
     @app.post('/api/total')
     async def total_handler(request):
-        logger.log(logging.INFO, f'/api/total: {request.json}')
+        log_request(request)
         try:
-            points = request.json.get('geometry')['coordinates'][0]
-            if len(points) < 3:
-                raise Exception('Too few points.')
+            with metrics.time('stage_seconds', endpoint=request.ctx.endpoint,
+                              stage='convex'):
+                mode, region = parse_region(request.json.get('geometry'),
+                                            request.json.get('mode'))
+            if mode == 'polygon':
+                key = region_key(mode, region)
+                ans = app.ctx.cache.get(key)
+                if ans is None:
+                    ans = await app.ctx.executor.run(calc_whole_polygon,
+                                                     region)
+                    app.ctx.cache.put(key, ans)
+                return response.json({
+                    'population': ans
+                })
 
-            convex = calc_convex(list(Point2D(p[0], p[1]) for p in points))
-
-            loop = asyncio.get_event_loop()
-            ans = await loop.run_in_executor(
-                None, calc_whole_convex, convex, app.ctx.data_accessor
-            )
+            convex = region
+            key = region_key(mode, convex)
+            ans = app.ctx.cache.get(key)
+            if ans is None:
+                ans = await app.ctx.executor.run(
+                    app.ctx.calc_whole_convex, convex
+                )
+                app.ctx.cache.put(key, ans)
 
             logger.debug(f'convex: {convex}, ans: {ans}')
             return response.json({
-                'convex': [[p.x, p.y] for p in convex],
+                'convex': convex.vertices.tolist(),
                 'population': ans
             })
 
@@ -47,76 +369,160 @@ def create_app():
                 'error': str(e)
             })
 
+    @app.post('/api/total/batch')
+    async def batch_handler(request):
+        log_request(request)
+        try:
+            if request.json.get('type') != 'FeatureCollection':
+                raise Exception('Expected a FeatureCollection.')
+            mode = request.json.get('mode')
+            regions = []
+            with metrics.time('stage_seconds', endpoint=request.ctx.endpoint,
+                              stage='convex'):
+                for i, feature in enumerate(request.json.get('features')):
+                    try:
+                        regions.append(parse_region(feature['geometry'],
+                                                    mode))
+                    except Exception as e:
+                        raise Exception(f'Feature {i}: {e}')
+
+            # only the regions missing from the cache are computed, split
+            # into chunks that the executor runs in parallel; the other
+            # engines run on every region, as for /api/total
+            shared = CONFIG.QUERY_ENGINE in ROW_SPAN_ENGINES
+            keys = [region_key(*region, batch=shared) for region in regions]
+            ans = [app.ctx.cache.get(key) for key in keys]
+            missing = [i for i, value in enumerate(ans) if value is None]
+            chunk = max(1, CONFIG.BATCH_CHUNK)
+            chunks = [missing[i:i + chunk]
+                      for i in range(0, len(missing), chunk)]
+            results = await asyncio.gather(*(
+                app.ctx.executor.run(calc_batch,
+                                     [regions[i][1] for i in indices])
+                if shared else
+                app.ctx.executor.run(calc_batch_by_engine,
+                                     [regions[i][1] for i in indices],
+                                     CONFIG.QUERY_ENGINE)
+                for indices in chunks
+            ))
+            for indices, values in zip(chunks, results):
+                for i, value in zip(indices, values):
+                    ans[i] = value
+                    app.ctx.cache.put(keys[i], value)
+
+            return response.json({
+                'population': ans
+            })
+
+        except Exception as e:
+            logger.fatal(f'/api/total/batch: {e.__repr__()}', exc_info=True)
+            return response.json({
+                'error': str(e)
+            })
+
     @app.post('/api/grid')
     async def grid_handler(request):
-        logger.log(logging.INFO, f'/api/grid: {request.json}')
+        log_request(request)
         try:
-            points = request.json.get('geometry')['coordinates'][0]
-            width = request.json.get('grid_width')
-
-            if len(points) < 3:
-                raise Exception('Too few points.')
-            if width < 1:
-                raise Exception('Grid width must be positive.')
-
-            min_x = min(p[0] for p in points)
-            max_x = max(p[0] for p in points)
-            min_y = min(p[1] for p in points)
-            max_y = max(p[1] for p in points)
-
-            convex = calc_convex(list(Point2D(p[0], p[1]) for p in points))
-
-            cache = {}
-            ans_mat = []
-            for x in range(min_x, max_x + 1, width):
-                ans_mat.append([])
-                for y in range(min_y, max_y + 1, width):
-                    square = [
-                        Point2D(x, y), Point2D(x + width, y),
-                        Point2D(x, y + width), Point2D(x + width, y + width)
-                    ]
-
-                    valid = False
-                    for p in square:
-                        if p not in cache:
-                            cache[p] = await (asyncio.get_event_loop()
-                                              .run_in_executor(
-                                None, point_in_convex, p, convex)
-                            )
-                        if cache[p]:
-                            valid = True
-                            break
-                    if not valid:
-                        ans_mat[-1].append(-1)
-                        continue
-
-                    ans = 0
-                    conv = calc_convex(square)
-                    loop = asyncio.get_event_loop()
-                    ans += await loop.run_in_executor(
-                        None, calc_whole_convex,
-                        conv, app.ctx.data_accessor
-                    )
-                    ans_mat[-1].append(ans)
+            with metrics.time('stage_seconds', endpoint=request.ctx.endpoint,
+                              stage='convex'):
+                args = parse_grid(request.json)
+            key = hull_key(args[0], 'grid', args[-1])
+            ans_mat = app.ctx.cache.get(key)
+            if ans_mat is None:
+                ans_mat = await app.ctx.executor.run(calc_grid, *args)
+                app.ctx.cache.put(key, ans_mat)
+            origin = grid_origin(args[1], args[3], args[-1],
+                                 app.ctx.data_accessor)
+
+            with metrics.time('stage_seconds', endpoint=request.ctx.endpoint,
+                              stage='encode'):
+                if NPY_MIME in request.headers.get('accept', ''):
+                    return npy_response(request, ans_mat, {
+                        ORIGIN_HEADER: '{},{}'.format(*origin)
+                    })
+                return response.json({
+                    'grid': ans_mat.tolist(),
+                    'origin': origin,
+                })
 
+        except Exception as e:
+            logger.fatal(f'/api/grid: {e.__repr__()}', exc_info=True)
             return response.json({
-                'grid': ans_mat,
+                'error': str(e)
             })
 
+    @app.post('/api/grid/stream')
+    async def grid_stream_handler(request):
+        """
+        Same as /api/grid, but sent as newline-delimited JSON while it is
+        computed: first ``{"shape": [rows, cols], "origin": [x, y]}``, then one
+        ``{"row": i, "values": [...]}`` per grid row. The bands computed at
+        once start at a single row and double up to `STREAM_MAX_BAND`.
+        """
+        log_request(request)
+        try:
+            with metrics.time('stage_seconds', endpoint=request.ctx.endpoint,
+                              stage='convex'):
+                args = parse_grid(request.json)
+            key = hull_key(args[0], 'grid', args[-1])
+            ans_mat = app.ctx.cache.get(key)
+            shape = ans_mat.shape if ans_mat is not None else \
+                grid_shape(*args[1:], app.ctx.data_accessor)
+            origin = grid_origin(args[1], args[3], args[-1],
+                                 app.ctx.data_accessor)
         except Exception as e:
-            logger.fatal(f'/api/grid: {e.__repr__()}', exc_info=True)
+            logger.fatal(f'/api/grid/stream: {e.__repr__()}', exc_info=True)
             return response.json({
                 'error': str(e)
             })
 
+        request.ctx.streamed = True
+        stream = await request.respond(content_type='application/x-ndjson')
+        await stream.send(json.dumps({'shape': shape, 'origin': origin})
+                          + '\n')
+        bands = []
+        first, band = 0, 1
+        try:
+            while first < shape[0]:
+                if ans_mat is not None:
+                    rows = ans_mat[first:first + band]
+                else:
+                    rows = await app.ctx.executor.run(
+                        calc_grid_rows, *args, first, first + band
+                    )
+                    bands.append(rows)
+                await stream.send(''.join(
+                    json.dumps({'row': first + i, 'values': row}) + '\n'
+                    for i, row in enumerate(rows.tolist())
+                ))
+                first += band
+                band = min(band * 2, STREAM_MAX_BAND)
+            if ans_mat is None:
+                app.ctx.cache.put(key, np.concatenate(bands))
+        except Exception as e:
+            logger.fatal(f'/api/grid/stream: {e.__repr__()}', exc_info=True)
+            await stream.send(json.dumps({'error': str(e)}) + '\n')
+        await stream.eof()
+        observe_request(request)
+
     return app
 
 
 class Server:
     def __init__(self, port: int):
-        self.loader = AppLoader(factory=partial(create_app))
+        self.loader = AppLoader(factory=partial(create_app, CONFIG))
         self.app = self.loader.load()
-        self.app.prepare(host='0.0.0.0', port=port, dev=True)
+        if CONFIG.EXECUTOR == 'process':
+            # Sanic workers are daemonic and cannot own the query processes,
+            # so the pool runs under a single, non-daemonic server process.
+            self.app.prepare(host='0.0.0.0', port=port, debug=True,
+                             single_process=True)
+        else:
+            self.app.prepare(host='0.0.0.0', port=port, dev=True)
 
     def run(self):
-        Sanic.serve(primary=self.app, app_loader=self.loader)
+        if CONFIG.EXECUTOR == 'process':
+            Sanic.serve_single(primary=self.app)
+        else:
+            Sanic.serve(primary=self.app, app_loader=self.loader)
@@ -0,0 +1,224 @@
+from .algo_test import make_accessor
+from .server import *
+from config.project_meta import __project__
+from util.codec import decode_npy
+
+from unittest import mock
+
+import tempfile
+import time
+import unittest
+
+
+def polygon(*points) -> dict:
+    return {'type': 'Polygon', 'coordinates': [list(points)]}
+
+
+class ServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # every test creates its own app under the same name
+        Sanic.test_mode = True
+
+    def setUp(self):
+        self.instance_dir = CONFIG.INSTANCE_DIR
+        self.query_engine = CONFIG.QUERY_ENGINE
+        self.tmp = tempfile.TemporaryDirectory()
+        CONFIG.INSTANCE_DIR = self.tmp.name
+        make_accessor()
+        self.app = self.create_app()
+
+    def tearDown(self):
+        CONFIG.INSTANCE_DIR = self.instance_dir
+        CONFIG.QUERY_ENGINE = self.query_engine
+        del self.app
+        self.tmp.cleanup()
+
+    @staticmethod
+    def create_app():
+        app = create_app(CONFIG)
+        # another app of the process, e.g. from the benchmarks, may have
+        # rewritten the server methods already
+        app.config.TOUCHUP = False
+        return app
+
+    def post(self, path: str, body: dict, headers: dict = None):
+        _, res = self.app.test_client.post(path, json=body, headers=headers)
+        self.assertEqual(200, res.status)
+        return res
+
+    def check_batch(self):
+        features = [
+            polygon((1, 4), (12, 2), (14, 29), (3, 20)),
+            {'type': 'MultiPolygon', 'coordinates': [[
+                [(2, 3), (9, 3), (9, 20), (2, 20)],
+                [(4, 6), (4, 10), (7, 10), (7, 6)],
+            ]]},
+        ]
+        expected = [
+            self.post('/api/total', {'geometry': geometry,
+                                     'mode': 'polygon'}).json['population']
+            for geometry in features
+        ]
+        body = {'type': 'FeatureCollection', 'mode': 'polygon', 'features': [
+            {'type': 'Feature', 'geometry': geometry} for geometry in features
+        ]}
+        ans = self.post('/api/total/batch', body).json['population']
+        for a, b in zip(expected, ans):
+            self.assertAlmostEqual(a, b, places=3)
+
+        # the second batch is read from the cache
+        hits = self.app.ctx.cache.stats()['hits']
+        self.assertEqual(ans, self.post('/api/total/batch',
+                                        body).json['population'])
+        self.assertEqual(hits + 2, self.app.ctx.cache.stats()['hits'])
+
+        # convexes are only shared with /api/total by the other engines
+        body['mode'] = 'convex'
+        del body['features'][1]
+        ans = self.post('/api/total/batch', body).json['population']
+        total = self.post('/api/total', {'geometry': features[0],
+                                         'mode': 'convex'}).json
+        self.assertAlmostEqual(total['population'], ans[0], places=3)
+        return ans[0]
+
+    def test_total_mode(self):
+        # an L, whose hull covers the notch too
+        ring = ((0, 0), (12, 0), (12, 6), (6, 6), (6, 24), (0, 24))
+        da = self.app.ctx.data_accessor
+        res = self.post('/api/total', {'geometry': polygon(*ring)}).json
+        self.assertEqual({'population'}, set(res))
+        self.assertAlmostEqual(
+            calc_whole_polygon([Polygon(ring)], da), res['population'],
+            places=3
+        )
+        res = self.post('/api/total', {'geometry': polygon(*ring),
+                                       'mode': 'convex'}).json
+        convex = calc_convex(Polygon(ring))
+        self.assertEqual(convex.vertices.tolist(), res['convex'])
+        self.assertAlmostEqual(ENGINES[CONFIG.QUERY_ENGINE](convex, da),
+                               res['population'], places=3)
+
+    def test_batch(self):
+        self.check_batch()
+
+    def test_batch_engine(self):
+        CONFIG.QUERY_ENGINE = 'exact'
+        self.app = self.create_app()
+        exact = self.check_batch()
+        self.assertNotAlmostEqual(
+            calc_whole_convex_vectorized(
+                calc_convex(Polygon(((1, 4), (12, 2), (14, 29), (3, 20)))),
+                self.app.ctx.data_accessor
+            ), exact, places=3
+        )
+
+    def test_batch_errors(self):
+        res = self.post('/api/total/batch', {'type': 'Feature'})
+        self.assertIn('FeatureCollection', res.json['error'])
+        res = self.post('/api/total/batch', {
+            'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'geometry': polygon((0, 0), (4, 0),
+                                                        (4, 4))},
+                {'type': 'Feature', 'geometry': polygon((0, 0))},
+            ]
+        })
+        self.assertTrue(res.json['error'].startswith('Feature 1: '))
+
+    def test_grid_npy(self):
+        body = {'geometry': polygon((1, 4), (12, 2), (14, 29), (3, 20)),
+                'grid_width': 5}
+        expected = self.post('/api/grid', body).json
+        for encoding in ('gzip', 'identity'):
+            res = self.post('/api/grid', body, {
+                'Accept': NPY_MIME, 'Accept-Encoding': encoding
+            })
+            self.assertEqual(NPY_MIME, res.headers['content-type'])
+            self.assertEqual(encoding == 'gzip',
+                             res.headers.get('content-encoding') == 'gzip')
+            self.assertEqual('{},{}'.format(*expected['origin']),
+                             res.headers[ORIGIN_HEADER])
+            self.assertEqual(expected['grid'], decode_npy(res.body).tolist())
+
+    def test_grid_stream(self):
+        bands = []
+
+        def record_band(*args):
+            bands.append(args[-3:-1])
+            return calc_grid_rows(*args)
+
+        body = {'geometry': polygon((0, 0), (15, 1), (14, 31), (2, 20)),
+                'grid_width': 1}
+        with mock.patch(f'{create_app.__module__}.calc_grid_rows',
+                        record_band):
+            res = self.post('/api/grid/stream', body)
+        expected = self.post('/api/grid', body).json
+        self.assertEqual('application/x-ndjson', res.headers['content-type'])
+
+        # one JSON object per line, every line complete
+        self.assertTrue(res.text.endswith('\n'))
+        lines = [json.loads(line) for line in res.text.splitlines()]
+        self.assertEqual({'shape': [16, 32], 'origin': expected['origin']},
+                         lines[0])
+        self.assertEqual(list(range(16)), [line['row'] for line in lines[1:]])
+        self.assertEqual(expected['grid'],
+                         [line['values'] for line in lines[1:]])
+
+        # the bands start at a single row and double
+        self.assertEqual([(0, 1), (1, 3), (3, 7), (7, 15), (15, 31)], bands)
+
+        # the cached grid is streamed again without being computed
+        bands.clear()
+        with mock.patch(f'{create_app.__module__}.calc_grid_rows',
+                        record_band):
+            self.assertEqual(res.text,
+                             self.post('/api/grid/stream', body).text)
+        self.assertEqual([], bands)
+
+    def test_metrics(self):
+        def slow_band(*args):
+            time.sleep(.01)
+            return calc_grid_rows(*args)
+
+        body = {'geometry': polygon((0, 0), (15, 1), (14, 31), (2, 20)),
+                'grid_width': 1}
+        with mock.patch(f'{create_app.__module__}.calc_grid_rows',
+                        slow_band):
+            self.post('/api/grid/stream', body)
+        self.post('/api/total', {'geometry': body['geometry']})
+        self.post('/api/total', {'geometry': body['geometry']})
+        _, res = self.app.test_client.get('/metrics')
+        prefix = f'{__project__.lower()}_'
+        lines = res.text.splitlines()
+        for name in ('cache_hits_total', 'cache_misses_total',
+                     'tile_cache_hits_total', 'tile_cache_misses_total'):
+            self.assertIn(f'# TYPE {prefix}{name} counter', lines)
+        self.assertIn(f'{prefix}cache_hits_total 1.0', lines)
+
+        # a stream is timed to the end of its body, five bands here
+        stream = f'{prefix}request_seconds_sum{{endpoint="/api/grid/stream"}}'
+        seconds = [float(line.split()[-1]) for line in lines
+                   if line.startswith(stream)]
+        self.assertEqual(1, len(seconds))
+        self.assertGreaterEqual(seconds[0], .05)
+
+    def test_tiles(self):
+        _, res = self.app.test_client.get('/tiles/1/1/0.png')
+        self.assertEqual(200, res.status)
+        self.assertEqual('image/png', res.headers['content-type'])
+        self.assertTrue(res.body.startswith(b'\x89PNG'))
+
+        hits = self.app.ctx.tile_cache.stats()['hits']
+        _, again = self.app.test_client.get('/tiles/1/1/0.png')
+        self.assertEqual(res.body, again.body)
+        self.assertEqual(hits + 1, self.app.ctx.tile_cache.stats()['hits'])
+
+        for path in ('/tiles/0/2/0.png', '/tiles/1/0/2.png',
+                     '/tiles/-1/0/0.png'):
+            _, res = self.app.test_client.get(path)
+            self.assertEqual(404, res.status)
+            self.assertIn('error', res.json)
+
+
+if __name__ == '__main__':
+    unittest.main()
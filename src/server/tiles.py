@@ -0,0 +1,243 @@
+from .cache import ResultCache
+from .metrics import stage
+from config import CONFIG
+
+from matplotlib import colormaps, image
+from typing import Optional, Tuple
+
+import asyncio
+import io
+import logging
+import math
+import numpy as np
+import os
+import shutil
+import tempfile
+import threading
+
+TILE_SIZE = 256
+
+
+def tile_edges(z: int, x: int, y: int, shape: Tuple[int, int],
+               size: int = TILE_SIZE) -> Tuple[float, np.ndarray, np.ndarray]:
+    """
+    Pixel edges of a tile on the raster.
+
+    The raster is equirectangular, so zoom ``z`` has ``2 ** z`` rows of
+    square tiles, ``y = 0`` being the northmost, and twice as many columns.
+
+    :param z: Zoom level.
+    :param x: Column of the tile.
+    :param y: Row of the tile.
+    :param shape: Shape of the raster.
+    :param size: Side length of a tile in pixels.
+    :return: ``(step, row_edges, col_edges)``: the side length of a pixel in
+             cells, and the ``size + 1`` edges of the pixels in each
+             direction.
+    """
+    rows, cols = shape
+    side = rows / 2 ** z
+    if z < 0 or not (0 <= y < 2 ** z and 0 <= x < math.ceil(cols / side)):
+        raise IndexError(f'Tile {z}/{x}/{y} out of range.')
+    step = side / size
+    offsets = np.arange(size + 1) * step
+    return step, y * side + offsets, x * side + offsets
+
+
+def tile_density(z: int, x: int, y: int, data_accessor) -> np.ndarray:
+    """
+    Population per cell of every pixel of a tile.
+
+    Every pixel sums its cells with four lookups into the coarsest pyramid
+    level whose blocks are no larger than a pixel, so pixel edges are rounded
+    down to those blocks. When zoomed in beyond one cell per pixel, a pixel
+    shows the cell it lies in.
+
+    :param z: Zoom level.
+    :param x: Column of the tile.
+    :param y: Row of the tile.
+    :param data_accessor: DataAccessor object.
+    :return: ``(TILE_SIZE, TILE_SIZE)`` matrix, 0 outside the raster.
+    """
+    rows, cols = data_accessor._data_processed.shape
+    step, row_edges, col_edges = tile_edges(z, x, y, (rows, cols))
+    factor = max(f for f in data_accessor._pyramid if f <= max(step, 1))
+    level = data_accessor._pyramid[factor]
+
+    def block_edges(edges, limit):
+        lo = np.minimum(np.floor(edges[:-1] / factor).astype(np.int64), limit)
+        hi = np.minimum(np.maximum(np.floor(edges[1:] / factor), lo + 1)
+                        .astype(np.int64), limit)
+        return lo, hi
+
+    r_lo, r_hi = block_edges(row_edges, level.shape[0] - 1)
+    c_lo, c_hi = block_edges(col_edges, level.shape[1] - 1)
+    sums = (level[np.ix_(r_hi, c_hi)] - level[np.ix_(r_lo, c_hi)]
+            - level[np.ix_(r_hi, c_lo)] + level[np.ix_(r_lo, c_lo)])
+    area = np.outer(
+        np.minimum(r_hi * factor, rows) - np.minimum(r_lo * factor, rows),
+        np.minimum(c_hi * factor, cols) - np.minimum(c_lo * factor, cols)
+    )
+    return np.divide(sums, area, out=np.zeros(sums.shape), where=area > 0)
+
+
+def render_tile(z: int, x: int, y: int, data_accessor) -> bytes:
+    """
+    Render a tile of log-scaled population density as PNG, see
+    `tile_density`. Pixels without population are transparent.
+
+    :return: PNG bytes.
+    """
+    with stage('lookup'):
+        density = tile_density(z, x, y, data_accessor)
+    value = np.log1p(np.maximum(density, 0)) \
+        / np.log1p(CONFIG.TILE_MAX_DENSITY)
+    rgba = colormaps['viridis'](np.clip(value, 0, 1), bytes=True)
+    rgba[..., 3] = np.where(density > 0, 255, 0)
+
+    with stage('encode'):
+        f = io.BytesIO()
+        image.imsave(f, rgba, format='png')
+        return f.getvalue()
+
+
+class TileCache:
+    """
+    Two-level cache of rendered tiles: an in-memory LRU in front of PNG files
+    on disk.
+
+    The files live in a directory named after the summed-area table they
+    were rendered from, so tiles of old data are dropped when the data is
+    preprocessed again. When there are more than ``max_files`` files, the
+    least recently used ones are removed. Several server workers may share
+    the directory, so a file can disappear at any time.
+
+    `get` and `put` touch the disk on the calling thread; the server uses
+    `get_async` and `put_async`, which leave it to the default executor.
+    """
+
+    def __init__(self, directory: str, version: str, max_size: int,
+                 max_files: int):
+        """
+        :param directory: Directory of the disk cache.
+        :param version: Identifies the data the tiles are rendered from.
+        :param max_size: Maximum number of tiles in memory.
+        :param max_files: Maximum number of tiles on disk, 0 to disable.
+        """
+        self.memory = ResultCache(max_size)
+        self.max_files = max_files
+        self.directory = os.path.join(directory, version)
+        self._lock = threading.Lock()  # of the file count and eviction
+        os.makedirs(self.directory, exist_ok=True)
+        for entry in os.listdir(directory):
+            if entry != version:
+                logging.info(f'Removing stale tile cache {entry}...')
+                try:
+                    shutil.rmtree(os.path.join(directory, entry))
+                except FileNotFoundError:
+                    pass  # removed by another worker meanwhile
+        self.files = sum(len(files) for _, _, files in os.walk(self.directory))
+
+    def _file(self, key: Tuple[int, int, int]) -> str:
+        z, x, y = key
+        return os.path.join(self.directory, str(z), str(x), f'{y}.png')
+
+    def get(self, key: Tuple[int, int, int]) -> Optional[bytes]:
+        """
+        Look up a tile in memory, then on disk.
+
+        :param key: ``(z, x, y)``.
+        :return: PNG bytes, or None on a miss.
+        """
+        data = self.memory.get(key)
+        if data is not None or self.max_files <= 0:
+            return data
+        data = self._read(key)
+        if data is not None:
+            self.memory.put(key, data)
+        return data
+
+    async def get_async(self, key: Tuple[int, int, int]) -> Optional[bytes]:
+        """
+        Same as `get`, reading the disk in the default executor.
+        """
+        data = self.memory.get(key)
+        if data is not None or self.max_files <= 0:
+            return data
+        data = await asyncio.get_running_loop().run_in_executor(
+            None, self._read, key
+        )
+        if data is not None:
+            self.memory.put(key, data)
+        return data
+
+    def put(self, key: Tuple[int, int, int], data: bytes):
+        """
+        Store a tile in memory and on disk.
+
+        :param key: ``(z, x, y)``.
+        :param data: PNG bytes.
+        :return: None
+        """
+        self.memory.put(key, data)
+        if self.max_files > 0:
+            self._write(key, data)
+
+    async def put_async(self, key: Tuple[int, int, int], data: bytes):
+        """
+        Same as `put`, writing the disk in the default executor.
+        """
+        self.memory.put(key, data)
+        if self.max_files > 0:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._write, key, data
+            )
+
+    def _read(self, key: Tuple[int, int, int]) -> Optional[bytes]:
+        file = self._file(key)
+        try:
+            with open(file, 'rb') as f:
+                data = f.read()
+            os.utime(file)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write(self, key: Tuple[int, int, int], data: bytes):
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        # a temporary file of its own, as other threads and workers may
+        # write the same tile
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(file))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            if not os.path.exists(file):
+                self.files += 1
+            os.replace(tmp, file)
+            if self.files > self.max_files:
+                self._evict()
+
+    def _evict(self):
+        # drop the least recently used tenth at once, so that the directory
+        # is not scanned for every new tile
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                file = os.path.join(root, name)
+                try:
+                    files.append((os.stat(file).st_mtime_ns, file))
+                except FileNotFoundError:
+                    pass
+        files.sort()
+        keep = self.max_files - self.max_files // 10
+        for _, file in files[:max(0, len(files) - keep)]:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+        self.files = min(len(files), keep)
+
+    def stats(self):
+        return {**self.memory.stats(), 'files': self.files,
+                'max_files': self.max_files}
@@ -0,0 +1,117 @@
+from .algo_test import make_accessor
+from .tiles import *
+
+from unittest import mock
+
+import asyncio
+import tempfile
+import unittest
+
+
+class TilesTest(unittest.TestCase):
+    def setUp(self):
+        self.instance_dir = CONFIG.INSTANCE_DIR
+        self.tmp = tempfile.TemporaryDirectory()
+        CONFIG.INSTANCE_DIR = self.tmp.name
+
+    def tearDown(self):
+        CONFIG.INSTANCE_DIR = self.instance_dir
+        self.tmp.cleanup()
+
+    def test_tile_edges(self):
+        step, rows, cols = tile_edges(1, 3, 1, (16, 32))
+        self.assertEqual(8 / TILE_SIZE, step)
+        self.assertEqual((8, 16), (rows[0], rows[-1]))
+        self.assertEqual((24, 32), (cols[0], cols[-1]))
+        for z, x, y in ((1, 4, 1), (1, 0, 2), (-1, 0, 0)):
+            with self.assertRaises(IndexError):
+                tile_edges(z, x, y, (16, 32))
+
+    def test_density_cells(self):
+        # 16 pixels per cell, every pixel shows its cell
+        da = make_accessor()
+        raw = np.diff(da._data_processed, axis=1, prepend=0)
+        density = tile_density(0, 1, 0, da)
+        np.testing.assert_allclose(
+            np.repeat(np.repeat(raw[:, 16:], 16, 0), 16, 1), density
+        )
+
+        png = image.imread(io.BytesIO(render_tile(0, 1, 0, da)))
+        self.assertEqual((TILE_SIZE, TILE_SIZE, 4), png.shape)
+        np.testing.assert_array_equal(density > 0, png[..., 3] > 0)
+
+    def test_density_pyramid(self):
+        # 600 / 256 cells per pixel, summed from the level of factor 2
+        da = make_accessor(tile=300)
+        raw = np.diff(da._data_processed, axis=1, prepend=0)
+        density = tile_density(0, 0, 0, da)
+        edges = np.floor(np.arange(TILE_SIZE + 1) * 600 / TILE_SIZE / 2) * 2
+        edges = edges.astype(int)
+        for i, j in ((0, 0), (100, 17), (255, 255)):
+            block = raw[edges[i]:edges[i + 1], edges[j]:edges[j + 1]]
+            self.assertAlmostEqual(block.mean(), density[i, j], places=3)
+
+    def test_cache(self):
+        directory = os.path.join(self.tmp.name, 'cache')
+        os.makedirs(os.path.join(directory, 'old'))
+        cache = TileCache(directory, 'new', 2, 10)
+        self.assertEqual(['new'], os.listdir(directory))
+        for i in range(10):
+            cache.put((1, 0, i), b'%d' % i)
+        self.assertEqual(10, cache.files)
+        self.assertEqual(b'9', cache.get((1, 0, 9)))
+
+        # a new cache reads the files; the 11th one evicts the oldest tenth
+        cache = TileCache(directory, 'new', 2, 10)
+        self.assertEqual(b'5', cache.get((1, 0, 5)))
+        os.utime(cache._file((1, 0, 0)), ns=(0, 0))
+        cache.put((1, 0, 10), b'10')
+        self.assertEqual(9, cache.files)
+        self.assertIsNone(cache.get((1, 0, 0)))
+        self.assertEqual(b'10', cache.get((1, 0, 10)))
+
+    def test_cache_async(self):
+        directory = os.path.join(self.tmp.name, 'cache')
+
+        async def put_get():
+            cache = TileCache(directory, 'new', 2, 10)
+            await cache.put_async((1, 0, 0), b'0')
+            # read from disk by a cache with an empty memory
+            cache = TileCache(directory, 'new', 2, 10)
+            return await cache.get_async((1, 0, 0)), \
+                await cache.get_async((1, 0, 1)), cache
+
+        data, missing, cache = asyncio.run(put_get())
+        self.assertEqual((b'0', None), (data, missing))
+        self.assertEqual(1, cache.files)
+        self.assertEqual(b'0', cache.memory.get((1, 0, 0)))
+
+    def test_cache_shared(self):
+        # other workers remove files and stale caches meanwhile
+        directory = os.path.join(self.tmp.name, 'cache')
+        os.makedirs(os.path.join(directory, 'old'))
+        with mock.patch('shutil.rmtree', side_effect=FileNotFoundError):
+            cache = TileCache(directory, 'new', 2, 10)
+        for i in range(10):
+            cache.put((1, 0, i), b'%d' % i)
+
+        stat, remove = os.stat, os.remove
+
+        def vanished_stat(file, *args, **kwargs):
+            if file == cache._file((1, 0, 0)):
+                raise FileNotFoundError(file)
+            return stat(file, *args, **kwargs)
+
+        def vanished_remove(file):
+            remove(file)
+            remove(file)
+
+        with mock.patch('os.stat', vanished_stat), \
+                mock.patch('os.remove', vanished_remove):
+            cache.put((1, 0, 10), b'10')
+        self.assertEqual(9, cache.files)
+        self.assertEqual(b'10', cache.get((1, 0, 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
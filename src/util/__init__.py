@@ -3,3 +3,4 @@
 from .file import *
 from .time import *
 from .log import *
+from .codec import *
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+Binary encoding of result matrices, as ``.npy`` bytes.
+"""
+
+import gzip
+import io
+import numpy as np
+
+NPY_MIME = 'application/x-npy'
+# ``x,y`` of the first grid corner, sent along a ``.npy`` grid
+ORIGIN_HEADER = 'X-Grid-Origin'
+
+
+def encode_npy(array, dtype: str = '<f4') -> bytes:
+    """
+    Encode a matrix as ``.npy`` bytes, little-endian float32 by default.
+
+    :param array: Array-like matrix.
+    :param dtype: Data type written.
+    :return: Header and raw data.
+    """
+    f = io.BytesIO()
+    np.save(f, np.ascontiguousarray(array, dtype=dtype))
+    return f.getvalue()
+
+
+def decode_npy(data: bytes) -> np.ndarray:
+    """
+    Decode ``.npy`` bytes, gzip-compressed or not, without copying the data
+    after the header.
+
+    :param data: Bytes from `encode_npy`.
+    :return: Read-only array viewing ``data``.
+    """
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    f = io.BytesIO(data)
+    if np.lib.format.read_magic(f) == (1, 0):
+        header = np.lib.format.read_array_header_1_0(f)
+    else:
+        header = np.lib.format.read_array_header_2_0(f)
+    shape, fortran_order, dtype = header
+    array = np.frombuffer(data, dtype=dtype, count=int(np.prod(shape)),
+                          offset=f.tell())
+    return array.reshape(shape, order='F' if fortran_order else 'C')
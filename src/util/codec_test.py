@@ -0,0 +1,25 @@
+from .codec import *
+
+import unittest
+
+
+class CodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        grid = np.arange(12, dtype=np.float64).reshape(3, 4) - 1
+        data = encode_npy(grid)
+        decoded = decode_npy(data)
+        self.assertEqual(np.dtype('<f4'), decoded.dtype)
+        np.testing.assert_array_equal(grid, decoded)
+        self.assertFalse(decoded.flags.writeable)
+
+        np.testing.assert_array_equal(grid, decode_npy(gzip.compress(data)))
+
+    def test_size(self):
+        grid = np.random.default_rng(0).random((100, 100)) * 1e5
+        data = encode_npy(grid)
+        self.assertLess(len(data), 100 * 100 * 4 + 256)
+        self.assertEqual((100, 100), decode_npy(data).shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,19 +2,24 @@
 
 from config import CONFIG
 
+import atexit
 import logging
+import logging.handlers
 import colorlog
 import os
+import queue
 
-from typing import Optional
+from typing import Any, Callable, Optional
 
 
-def init_logging(level: str, log_file: str):
+def init_logging(level: str, log_file: str, use_queue: bool = False):
     """
     Initialize logging system.
 
     :param level: Logging level.
     :param log_file: Logging file.
+    :param use_queue: Write the records from a background thread, see
+                      `queue_logging`.
     :return: None
     """
     log_file = os.path.join(CONFIG.INSTANCE_DIR, log_file)
@@ -46,5 +51,70 @@ def init_logging(level: str, log_file: str):
         }
     ))
     logging.getLogger().addHandler(stream_handler)
+    if use_queue:
+        atexit.register(queue_logging(''))
 
     logging.info('Logging service initialised.')
+
+
+def queue_logging(*names: str) -> Callable[[], None]:
+    """
+    Put the handlers of some loggers behind queues, so that logging a record
+    only formats its message and enqueues it, while a listener thread runs
+    the handlers, i.e. the console and file writes.
+
+    :param names: Names of the loggers, ``''`` for the root logger.
+    :return: Function flushing the queues and restoring the handlers.
+    """
+    moved = []
+    for name in names:
+        logger = logging.getLogger(name)
+        handlers = logger.handlers[:]
+        if not handlers or all(isinstance(h, logging.handlers.QueueHandler)
+                               for h in handlers):
+            continue
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            records, *handlers, respect_handler_level=True
+        )
+        listener.start()
+        logger.handlers = [logging.handlers.QueueHandler(records)]
+        moved.append((logger, handlers, listener))
+
+    def restore():
+        for logger, handlers, listener in moved:
+            logger.handlers = handlers
+            listener.stop()
+        moved.clear()
+
+    return restore
+
+
+def summarize(value: Any, limit: int, items: int = 3) -> str:
+    """
+    Short text of a request payload for the log. Lists longer than `items`
+    keep their first elements and the count of the rest, e.g. the points of
+    a polygon, and the text is cut to `limit` characters.
+
+    :param value: JSON-like value.
+    :param limit: Maximum length of the text, 0 for the whole payload.
+    :param items: Elements shown of a long list.
+    :return: Summary.
+    """
+    if limit <= 0:
+        return repr(value)
+
+    def shorten(value):
+        if isinstance(value, dict):
+            return {k: shorten(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            head = [shorten(v) for v in value[:items]]
+            if len(value) > items:
+                head.append(f'... {len(value) - items} more')
+            return head
+        return value
+
+    text = repr(shorten(value))
+    if len(text) > limit:
+        text = f'{text[:limit]}... ({len(text)} chars)'
+    return text
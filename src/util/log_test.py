@@ -0,0 +1,50 @@
+from .log import *
+
+import threading
+import unittest
+
+
+class LogTest(unittest.TestCase):
+    def test_queue_logging(self):
+        class Recorder(logging.Handler):
+            def __init__(self):
+                super().__init__()
+                self.records = []
+
+            def emit(self, record):
+                self.records.append((threading.current_thread(),
+                                     record.getMessage()))
+
+        logger = logging.getLogger(f'{__name__}.queue')
+        logger.propagate = False
+        recorder = Recorder()
+        logger.addHandler(recorder)
+        try:
+            restore = queue_logging(logger.name)
+            self.assertIsInstance(logger.handlers[0],
+                                  logging.handlers.QueueHandler)
+            logger.warning('%s points', 5)
+            restore()
+            self.assertEqual([recorder], logger.handlers)
+            [(thread, message)] = recorder.records
+            self.assertEqual('5 points', message)
+            self.assertIsNot(threading.current_thread(), thread)
+        finally:
+            logger.removeHandler(recorder)
+
+    def test_summarize(self):
+        geometry = {'type': 'Polygon',
+                    'coordinates': [[[i, i] for i in range(100)]]}
+        self.assertEqual(
+            "{'type': 'Polygon', 'coordinates': "
+            "[[[0, 0], [1, 1], [2, 2], '... 97 more']]}",
+            summarize(geometry, 100)
+        )
+        self.assertEqual(repr(geometry), summarize(geometry, 0))
+        self.assertEqual("{'type': 'Po... (77 chars)",
+                         summarize(geometry, 12))
+        self.assertEqual('[1, 2]', summarize([1, 2], 12))
+
+
+if __name__ == '__main__':
+    unittest.main()